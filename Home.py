@@ -1,5 +1,7 @@
 import streamlit as st
 
+from arrow_counter.warmup import start_warmup
+
 # Set the page config to open to the hello page by default
 st.set_page_config(
     page_title="Home",
@@ -7,6 +9,10 @@ st.set_page_config(
 )
 
 
+# Load the data and run the default queries in the background, so the first
+# user after a deploy does not wait for them
+start_warmup()
+
 st.title("Welcome to the ARROW Data Counter")
 st.write("Use the menu on the left to select a page.")
 
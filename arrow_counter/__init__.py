@@ -0,0 +1 @@
+"""Shared data layer for the ARROW Data Counter pages."""
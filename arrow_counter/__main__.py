@@ -0,0 +1,6 @@
+"""Entry point of `python -m arrow_counter`."""
+import sys
+
+from arrow_counter.cli import main
+
+sys.exit(main())
@@ -0,0 +1,56 @@
+"""Pieces shared by the DuckDB and Polars row backends.
+
+A backend holds its own copy of a dataset, so building one is costly and a
+process keeps a single backend per kind, for the latest dataset. A
+`BackendCache` builds it on first use and again after a swap. Queries come
+with the widget selections, which may hold numpy scalars; `python_value`
+turns them into the plain values the backends bind and compare with.
+"""
+import logging
+import threading
+from typing import Callable
+
+import numpy as np
+
+from arrow_counter.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+def python_value(value):
+    """Turns numpy scalars into Python values, other values are returned as they are"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class BackendCache:
+    """Backend of the latest dataset, built on first use
+
+    Only the backend of the latest dataset is kept, a swapped-in dataset
+    replaces it.
+
+    Args:
+        build (Callable[[Dataset], object]): builds the backend of a dataset,
+                                             which keeps its `version`
+        name (str): backend name for the logs
+    """
+
+    def __init__(self, build: Callable[[Dataset], object], name: str):
+        self._build = build
+        self._name = name
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def get(self, dataset: Dataset):
+        """Returns the backend of a dataset, building it when the dataset changed
+
+        Args:
+            dataset (Dataset): loaded arrow dataset
+
+        Returns:
+            backend serving the dataset
+        """
+        with self._lock:
+            if self._backend is None or self._backend.version != dataset.version:
+                logger.info("Loading dataset %s into %s", dataset.version[:12], self._name)
+                self._backend = self._build(dataset)
+            return self._backend
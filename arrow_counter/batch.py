@@ -0,0 +1,153 @@
+"""Counts for many filter combinations in one call.
+
+`batch_count` evaluates a list of filter specs, each the `cols` dict the
+pages pass to the engine, and returns one tidy table. Specs the range cube
+covers are answered from it. The others share their work: the mask of every
+distinct (column, selection) is built once, and the counts of a block of specs
+come out of one matrix product with the non-blank matrix, per tss bin.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.cube import RANGE_COLUMNS
+from arrow_counter.data import TIMEPOINTS, VARIABLES, Dataset
+from arrow_counter.engine import filter_mask
+from arrow_counter.timepoints import timepoint_edges, timepoint_sums
+
+# Timepoint label of the counts over every tss, as count_non_blank gives them
+TOTAL = "total"
+
+# Rough number of mask cells evaluated at once, bounds the memory of a block
+BLOCK_CELLS = 1 << 25
+
+
+def spec_grid(options: dict[str, list]) -> list[dict[str, list | tuple]]:
+    """Builds every combination of the given filter options
+
+    Args:
+        options (dict[str, list]): candidate selections by column, e.g.
+            {'sex_dashboard': [['Female'], ['Male']], 'age': [(10, 20), (20, 30)]}
+
+    Returns:
+        list[dict[str, list | tuple]]: one filter spec per combination
+    """
+    columns = list(options)
+    return [dict(zip(columns, choice)) for choice in itertools.product(*options.values())]
+
+
+def _describe(specs: list[dict[str, list | tuple]]) -> pd.DataFrame:
+    """Flattens filter specs into columns, ranges as low/high and selections as text"""
+    columns = list(dict.fromkeys(column for cols in specs for column in cols))
+    described = {}
+    for column in columns:
+        if column in RANGE_COLUMNS:
+            described[f"{column}_low"] = [cols[column][0] if column in cols else None for cols in specs]
+            described[f"{column}_high"] = [cols[column][1] if column in cols else None for cols in specs]
+        else:
+            described[column] = [", ".join(map(str, cols[column])) if cols.get(column) else None
+                                 for cols in specs]
+    return pd.DataFrame(described, index=range(len(specs)))
+
+
+def _masked_counts(dataset: Dataset, specs: list[dict[str, list | tuple]], variables: list[str],
+                   edges: np.ndarray, only_long_term_outcomes: bool) -> np.ndarray:
+    """Counts the specs under row masks, per tss bin
+
+    Rows are sorted by tss bin once, so every bin is a contiguous slice of the
+    mask block and of the non-blank matrix.
+
+    Returns:
+        np.ndarray: counts shaped (spec, bin, variable), the last bin holding the
+                    rows outside every timepoint
+    """
+    frame = dataset.frame
+    n_rows, n_bins = len(frame), max(len(edges), 1)
+    bins = np.searchsorted(edges, frame['tss'].to_numpy(dtype=float), side='right') - 1
+    bins[(bins < 0) | (bins >= n_bins - 1)] = n_bins - 1
+    order = np.argsort(bins, kind='stable')
+    bin_starts = np.searchsorted(bins[order], np.arange(n_bins + 1))
+
+    # Float sums of 0/1 are exact while they stay below the mantissa size
+    dtype = np.float32 if n_rows < 2**24 else np.float64
+    notna = dataset.notna_matrix(variables)[order].astype(dtype)
+    base = (dataset.index.long_term_outcomes[order] if only_long_term_outcomes
+            else np.ones(n_rows, dtype=bool))
+
+    # Each distinct selection of a column is only resolved once for all specs
+    part_masks = {}
+
+    def part_mask(column: str, values: list | tuple) -> np.ndarray:
+        key = (column, tuple(values))
+        if key not in part_masks:
+            part_masks[key] = filter_mask(frame, {column: values}, index=dataset.index)[order]
+        return part_masks[key]
+
+    counts = np.zeros((len(specs), n_bins, len(variables)), dtype=np.int64)
+    block_size = max(1, BLOCK_CELLS // max(n_rows, 1))
+    for start in range(0, len(specs), block_size):
+        block = specs[start:start + block_size]
+        masks = np.empty((len(block), n_rows), dtype=dtype)
+        for row, cols in enumerate(block):
+            mask = base.copy()
+            for column, values in cols.items():
+                if column in RANGE_COLUMNS or values:
+                    mask &= part_mask(column, values)
+            masks[row] = mask
+        for b in range(n_bins):
+            low, high = bin_starts[b], bin_starts[b + 1]
+            counts[start:start + len(block), b] = np.rint(masks[:, low:high] @ notna[low:high])
+    return counts
+
+
+def batch_count(dataset: Dataset, specs: list[dict[str, list | tuple]], variables: list[str] = VARIABLES,
+                timepoints: dict[str, tuple[int, int]] = TIMEPOINTS,
+                only_long_term_outcomes: bool = False) -> pd.DataFrame:
+    """Counts non-blank records for many filter specs at once
+
+    Gives the same counts as calling `count_non_blank` and `count_by_timepoint`
+    for every spec.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        specs (list[dict[str, list | tuple]]): filters by column, one dict per query
+        variables (list[str]): list of columns to count
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+    Returns:
+        pd.DataFrame: one row per spec, variable and timepoint, with the spec's
+                      position, its filters, `variable`, `timepoint` (`TOTAL`
+                      for the count over every tss) and `count`
+    """
+    labels = [TOTAL, *timepoints]
+    # (spec, timepoint, variable), the total first
+    counts = np.zeros((len(specs), len(labels), len(variables)), dtype=np.int64)
+
+    cube = dataset.cube
+    on_cube = [cube is not None and cube.can_answer(cols, variables) for cols in specs]
+    for position, cols in enumerate(specs):
+        if on_cube[position]:
+            total = cube.count(cols, variables, only_long_term_outcomes)
+            by_timepoint = cube.count_by_timepoint(cols, timepoints, variables, only_long_term_outcomes)
+            counts[position, 0] = [total[var] for var in variables]
+            counts[position, 1:] = [[by_timepoint[var][tp] for var in variables] for tp in timepoints]
+
+    masked = [position for position, answered in enumerate(on_cube) if not answered]
+    if masked:
+        edges = timepoint_edges(timepoints)
+        bin_counts = _masked_counts(dataset, [specs[position] for position in masked], variables,
+                                    edges, only_long_term_outcomes)
+        counts[masked, 0] = bin_counts.sum(axis=1)
+        # The last bin holds the rows outside every timepoint
+        counts[masked, 1:] = timepoint_sums(edges, bin_counts[:, :-1], timepoints)
+
+    n_specs, n_labels, n_vars = counts.shape
+    spec_positions = np.repeat(np.arange(n_specs), n_labels * n_vars)
+    table = _describe(specs).iloc[spec_positions].reset_index(drop=True)
+    table.insert(0, 'spec', spec_positions)
+    table['variable'] = np.tile(variables, n_specs * n_labels)
+    table['timepoint'] = np.tile(np.repeat(labels, n_vars), n_specs)
+    table['count'] = counts.reshape(-1)
+    return table
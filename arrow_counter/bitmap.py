@@ -0,0 +1,110 @@
+"""Bit-packed non-blank matrix counted with popcount.
+
+Every count is the number of rows that are non-blank for a variable and match
+a filter mask. Packing each variable's non-blank flags into 64-bit words, one
+bit per row, makes that an AND and a popcount over n_rows / 64 words, with a
+working set 8 times smaller than a boolean matrix.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+# Bits set in every byte value, for numpy versions without bitwise_count
+_BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def pack_rows(flags: np.ndarray) -> np.ndarray:
+    """Packs boolean row flags into 64-bit words
+
+    Args:
+        flags (np.ndarray): (row,) or (row, column) boolean flags
+
+    Returns:
+        np.ndarray: (word,) or (column, word) uint64 words, bit i of word w
+                    holding row 64 * w + i
+    """
+    columns = np.atleast_2d(flags.T)
+    packed = np.packbits(columns, axis=1, bitorder='little')
+    # Pad every column to whole words, the padding bits are zero
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = np.pad(packed, ((0, 0), (0, padding)))
+    words = np.ascontiguousarray(packed).view('<u8')
+    return words[0] if flags.ndim == 1 else words
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """Counts the set bits of every word
+
+    Args:
+        words (np.ndarray): uint64 words
+
+    Returns:
+        np.ndarray: set bits per word, same shape as `words`
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    as_bytes = words.view(np.uint8).reshape(*words.shape, 8)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=-1)
+
+
+@dataclass(frozen=True)
+class NotnaBitmap:
+    """Non-blank flags of a set of variables, one bit per row
+
+    Attributes:
+        variables (list[str]): packed variables, first axis of `words`
+        words (np.ndarray): (variable, word) packed non-blank flags
+        n_rows (int): number of rows
+    """
+    variables: list[str]
+    words: np.ndarray
+    n_rows: int
+
+    def covers(self, variables: list[str]) -> bool:
+        """Returns `True` if every variable is packed."""
+        return set(variables) <= set(self.variables)
+
+    def _positions(self, variables: list[str]) -> np.ndarray | slice:
+        """Returns the rows of `words` holding the variables"""
+        if variables == self.variables:
+            return slice(None)
+        return np.array([self.variables.index(var) for var in variables], dtype=np.intp)
+
+    def count(self, mask: np.ndarray, variables: list[str]) -> np.ndarray:
+        """Counts the non-blank rows of each variable under a row mask
+
+        Args:
+            mask (np.ndarray): boolean row mask
+            variables (list[str]): packed variables to count
+
+        Returns:
+            np.ndarray: non-blank count per variable
+        """
+        selected = self.words[self._positions(variables)] & pack_rows(mask)
+        return popcount(selected).sum(axis=1, dtype=np.int64)
+
+    def unpack(self, variables: list[str]) -> np.ndarray:
+        """Returns the (row, variable) boolean non-blank matrix of the variables
+
+        Args:
+            variables (list[str]): packed variables, in order
+
+        Returns:
+            np.ndarray: (row, variable) non-blank matrix
+        """
+        as_bytes = self.words[self._positions(variables)].view(np.uint8)
+        return np.unpackbits(as_bytes, axis=1, count=self.n_rows, bitorder='little').T.astype(bool)
+
+
+def build_notna_bitmap(notna: np.ndarray, variables: list[str]) -> NotnaBitmap:
+    """Packs a (row, variable) non-blank matrix
+
+    Args:
+        notna (np.ndarray): (row, variable) boolean non-blank matrix
+        variables (list[str]): variables of the matrix columns
+
+    Returns:
+        NotnaBitmap: packed matrix
+    """
+    return NotnaBitmap(variables=list(variables), words=pack_rows(notna), n_rows=len(notna))
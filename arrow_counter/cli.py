@@ -0,0 +1,179 @@
+"""Command-line count reports, without the Streamlit runtime.
+
+Loads the dataset through its snapshot like the pages do, evaluates filter
+specs with `batch_count` and writes the per-variable and per-timepoint counts
+as CSV, Parquet or JSON:
+
+    python -m arrow_counter --filter sex_dashboard=Female --filter age=15:25
+    python -m arrow_counter --specs sweep.yaml --output counts.parquet
+
+A specs file holds a list of filter specs, or a mapping with a `specs` list
+and/or a `grid` of options per column that is expanded with `spec_grid`.
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from arrow_counter.batch import batch_count, spec_grid
+from arrow_counter.cube import RANGE_COLUMNS
+from arrow_counter.data import TIMEPOINTS, VARIABLES, load_dataset
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'parquet', 'json')
+
+
+def _value(text: str) -> int | float | str:
+    """Reads a filter value, as a number when it is one"""
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_filter(text: str) -> tuple[str, list | tuple]:
+    """Parses a `column=value,value` filter, `column=low:high` for age and tss
+
+    Args:
+        text (str): filter argument
+
+    Returns:
+        tuple[str, list | tuple]: column and its selection
+    """
+    column, sep, values = text.partition("=")
+    if not sep or not column:
+        raise argparse.ArgumentTypeError(f"expected column=values, got {text!r}")
+    if column in RANGE_COLUMNS:
+        low, sep, high = values.replace(",", ":").partition(":")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"expected {column}=low:high, got {text!r}")
+        return column, (_value(low), _value(high))
+    return column, [_value(value) for value in values.split(",") if value]
+
+
+def _selection(column: str, values) -> list | tuple:
+    """Checks one selection of a spec read from JSON or YAML
+
+    A single categorical value is taken as a one-value list, `list("Female")`
+    would split it into letters. Ranges come back as tuples.
+    """
+    if column in RANGE_COLUMNS:
+        if not isinstance(values, (list, tuple)) or len(values) != 2:
+            raise SystemExit(f"{column} must be a [low, high] range in the specs, got {values!r}")
+        return tuple(values)
+    if isinstance(values, (str, int, float)):
+        return [values]
+    if not isinstance(values, (list, tuple)):
+        raise SystemExit(f"{column} must be a value or a list of values in the specs, got {values!r}")
+    return list(values)
+
+
+def _normalize(cols: dict) -> dict[str, list | tuple]:
+    """Checks the selections of a spec read from JSON or YAML"""
+    return {column: _selection(column, values) for column, values in cols.items()}
+
+
+def read_specs(path: Path) -> list[dict[str, list | tuple]]:
+    """Reads filter specs from a JSON or YAML file
+
+    Args:
+        path (Path): specs file, YAML when its suffix is .yaml or .yml
+
+    Returns:
+        list[dict[str, list | tuple]]: filter specs
+    """
+    text = path.read_text()
+    if path.suffix.lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit("Reading YAML specs needs PyYAML, install it or use JSON") from None
+        content = yaml.safe_load(text)
+    else:
+        content = json.loads(text)
+
+    if isinstance(content, list):
+        return [_normalize(cols) for cols in content]
+    specs = [_normalize(cols) for cols in content.get('specs', [])]
+    if 'grid' in content:
+        grid = {}
+        for column, options in content['grid'].items():
+            if not isinstance(options, list):
+                raise SystemExit(f"The grid options of {column} must be a list, got {options!r}")
+            grid[column] = [_selection(column, option) for option in options]
+        specs.extend(spec_grid(grid))
+    return specs
+
+
+def write_table(table: pd.DataFrame, output: Path | None, output_format: str) -> None:
+    """Writes the counts table, to stdout when no output path is given
+
+    Args:
+        table (pd.DataFrame): counts from `batch_count`
+        output (Path | None): destination file
+        output_format (str): one of `FORMATS`
+    """
+    if output_format == 'parquet':
+        if output is None:
+            raise SystemExit("Parquet output needs --output")
+        table.to_parquet(output, index=False)
+    elif output_format == 'json':
+        table.to_json(output if output is not None else sys.stdout, orient='records', indent=1)
+    else:
+        table.to_csv(output if output is not None else sys.stdout, index=False)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the command-line argument parser."""
+    parser = argparse.ArgumentParser(prog="python -m arrow_counter",
+                                     description="Counts non-blank ARROW records by variable and timepoint.")
+    parser.add_argument("--export", type=Path,
+                        help="REDCap export to count, the newest one in ARROW_DATA_DIR by default")
+    parser.add_argument("--filter", type=parse_filter, action="append", default=[], dest="filters",
+                        metavar="COLUMN=VALUES",
+                        help="filter of a single spec, repeatable, e.g. sex_dashboard=Female or age=15:25")
+    parser.add_argument("--specs", type=Path, help="JSON or YAML file of filter specs")
+    parser.add_argument("--only-long-term-outcomes", action="store_true",
+                        help="only keep record ids with a long-term outcome")
+    parser.add_argument("--output", type=Path, help="output file, stdout by default")
+    parser.add_argument("--format", choices=FORMATS, dest="output_format",
+                        help="output format, taken from the output suffix by default, else csv")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress to stderr")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Runs the count report
+
+    Args:
+        argv (list[str] | None): command-line arguments, `sys.argv` when `None`
+
+    Returns:
+        int: exit status
+    """
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    specs = read_specs(args.specs) if args.specs is not None else []
+    if args.filters or not specs:
+        # No filters at all counts every record, like the pages before filtering
+        specs.insert(0, dict(args.filters))
+
+    output_format = args.output_format
+    if output_format is None:
+        suffix = args.output.suffix.lower().lstrip(".") if args.output is not None else ""
+        output_format = suffix if suffix in FORMATS else 'csv'
+
+    dataset = load_dataset(args.export)
+    logger.info("Counting %d specs on %s", len(specs), dataset.source)
+    table = batch_count(dataset, specs, variables=VARIABLES, timepoints=TIMEPOINTS,
+                        only_long_term_outcomes=args.only_long_term_outcomes)
+    write_table(table, args.output, output_format)
+    return 0
@@ -0,0 +1,375 @@
+"""Prefix-sum count cube answering the dashboard queries without a scan.
+
+Non-blank counts of every variable are accumulated per categorical cell (one
+combination of the categorical filter values and of the long-term outcome
+flag) on an age x tss grid, then turned into 2D cumulative sums. The count
+inside any age and tss range is then four lookups per selected cell combined by
+inclusion-exclusion, and a timepoint is one more tss range, so every query
+costs O(cells) independent of the number of rows.
+
+The slider ranges are closed (`between`) on float columns, so the grid cannot
+simply use integer buckets: 25.0 is inside an age range ending at 25 but 25.3
+is not. Every integer k therefore gets two grid keys, 2k for values equal to k
+and 2k + 1 for values strictly between k and k + 1, which makes any integer
+bounded range, closed or half-open, an exact range of keys. Only keys that
+occur in the data are kept on the grid. Blank ages and tss get a key after all
+others, reached only by queries that do not filter on that column.
+
+The prefix array grows with cells x age keys x tss keys x variables, not with
+the rows, and pooled exports with many distinct ages and times can make it
+much larger than the frame. Above `CUBE_BUDGET` bytes no cube is built and
+every query is counted from the rows.
+"""
+import logging
+import os
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.index import long_term_outcome_mask
+
+logger = logging.getLogger(__name__)
+
+RANGE_COLUMNS = ('age', 'tss')
+
+# Largest prefix array built, in bytes, above it queries are counted from the rows
+CUBE_BUDGET = int(os.getenv("ARROW_CUBE_BUDGET", str(64 << 20)))
+
+# Grid key of blank values, past every range a slider can select
+BLANK_KEY = np.iinfo(np.int64).max
+
+
+def grid_keys(values: np.ndarray) -> np.ndarray:
+    """Maps values to their grid keys, 2k for k and 2k + 1 for (k, k + 1)"""
+    blank = np.isnan(values)
+    values = np.where(blank, 0, values)
+    floor = np.floor(values)
+    keys = 2 * floor.astype(np.int64) + (values != floor)
+    keys[blank] = BLANK_KEY
+    return keys
+
+
+def is_integer(value) -> bool:
+    """Returns `True` if a range bound falls on a grid key."""
+    return float(value).is_integer()
+
+
+@dataclass(frozen=True)
+class RangeCube:
+    """Cumulative non-blank counts by categorical cell, age and tss
+
+    Attributes:
+        variables (list[str]): counted variables, last axis of `prefix`
+        columns (list[str]): categorical columns the cells are built from
+        uniques (dict[str, pd.Index]): values of each categorical column
+        cell_codes (dict[str, np.ndarray]): code of each cell's value per column,
+                                            -1 for blank
+        long_term (np.ndarray): whether each cell's rows belong to records with
+                                a long-term outcome
+        age_keys (np.ndarray): sorted age grid keys
+        tss_keys (np.ndarray): sorted tss grid keys
+        prefix (np.ndarray): cumulative counts shaped
+                             (cell, age key + 1, tss key + 1, variable)
+    """
+    variables: list[str]
+    columns: list[str]
+    uniques: dict[str, pd.Index]
+    cell_codes: dict[str, np.ndarray]
+    long_term: np.ndarray
+    age_keys: np.ndarray
+    tss_keys: np.ndarray
+    prefix: np.ndarray
+
+    def can_answer(self, cols: dict[str, list | tuple], variables: list[str]) -> bool:
+        """Checks whether a query can be answered from the cube
+
+        Age and tss ranges must have integer bounds and every other filter
+        must be on one of the cube's categorical columns.
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column
+            variables (list[str]): columns to count
+
+        Returns:
+            bool: `True` if `count` and `count_by_timepoint` can answer the query
+        """
+        if not all(is_integer(bound) for column in RANGE_COLUMNS if column in cols
+                   for bound in cols[column]):
+            return False
+        if any(column not in RANGE_COLUMNS and column not in self.columns for column in cols):
+            return False
+        return set(variables) <= set(self.variables)
+
+    @cached_property
+    def _value_codes(self) -> dict[str, dict[object, int]]:
+        """Code of every value of each categorical column, cheaper to probe than an index"""
+        return {column: {value: code for code, value in enumerate(uniques)}
+                for column, uniques in self.uniques.items()}
+
+    def cells(self, cols: dict[str, list | tuple], only_long_term_outcomes: bool) -> np.ndarray:
+        """Returns the positions of the cells matching the categorical filters"""
+        selected = self.long_term.copy() if only_long_term_outcomes else np.ones(len(self.long_term), dtype=bool)
+        for column in self.columns:
+            values = cols.get(column)
+            if values:
+                value_codes = self._value_codes[column]
+                codes = [value_codes[value] for value in values if value in value_codes]
+                selected &= np.isin(self.cell_codes[column], codes)
+        return np.flatnonzero(selected)
+
+    @staticmethod
+    def _bounds(keys: np.ndarray, low_key: int, high_key: int) -> tuple[int, int]:
+        """Converts an inclusive key range to prefix positions"""
+        low = np.searchsorted(keys, low_key, side='left')
+        high = np.searchsorted(keys, high_key, side='right')
+        return low, max(low, high)
+
+    def key_range(self, cols: dict[str, list | tuple], column: str) -> tuple[int, int]:
+        """Returns the prefix positions of a range filter, every key when not filtered"""
+        keys = self.age_keys if column == 'age' else self.tss_keys
+        if column not in cols:
+            return 0, len(keys)
+        low, high = cols[column]
+        return self._bounds(keys, 2 * int(low), 2 * int(high))
+
+    def timepoint_range(self, cols: dict[str, list | tuple], tp_low: int, tp_high: int) -> tuple[int, int]:
+        """Returns the tss prefix positions of a timepoint within the tss filter"""
+        tss_low, tss_high = cols.get('tss', (-np.inf, np.inf))
+        # Intersect the closed slider range with the half-open timepoint
+        return self._bounds(self.tss_keys, max(2 * tss_low, 2 * tp_low),
+                            min(2 * tss_high, 2 * tp_high - 1))
+
+    def _sum(self, cells: np.ndarray, age: tuple[int, int], tss: tuple[int, int],
+             var_positions: np.ndarray) -> np.ndarray:
+        """Counts per variable inside a rectangle of the prefix grid"""
+        a0, a1 = age
+        t0, t1 = tss
+        prefix = self.prefix
+        # Widen before subtracting, the cube uses the smallest unsigned dtype
+        total = (prefix[cells, a1, t1].astype(np.int64) - prefix[cells, a0, t1]
+                 - prefix[cells, a1, t0] + prefix[cells, a0, t0])
+        return total.sum(axis=0)[var_positions]
+
+    def count(self, cols: dict[str, list | tuple], variables: list[str],
+              only_long_term_outcomes: bool = False) -> dict[str, int]:
+        """Counts non-blank records for each variable given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column, see `can_answer`
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, int]: dictionary of non-blank counts
+        """
+        cells = self.cells(cols, only_long_term_outcomes)
+        counts = self._sum(cells, self.key_range(cols, 'age'), self.key_range(cols, 'tss'),
+                           self._positions(variables))
+        return dict(zip(variables, counts.tolist()))
+
+    def count_by_timepoint(self, cols: dict[str, list | tuple], timepoints: dict[str, tuple[int, int]],
+                           variables: list[str],
+                           only_long_term_outcomes: bool = False) -> dict[str, dict[str, int]]:
+        """Counts non-blank records for each variable and timepoint given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column, see `can_answer`
+            timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                     bound included, right excluded
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+        """
+        age = self.key_range(cols, 'age')
+        cells = self.cells(cols, only_long_term_outcomes)
+        positions = self._positions(variables)
+
+        longitudinal_counts = {var: {} for var in variables}
+        for tp_label, (tp_low, tp_high) in timepoints.items():
+            tss = self.timepoint_range(cols, tp_low, tp_high)
+            counts = self._sum(cells, age, tss, positions)
+            for var, count in zip(variables, counts.tolist()):
+                longitudinal_counts[var][tp_label] = count
+        return longitudinal_counts
+
+    def locate(self, rows: pd.DataFrame,
+               long_term_outcomes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """Finds the cell, age key and tss key of every row on the cube's grid
+
+        Args:
+            rows (pd.DataFrame): rows to locate
+            long_term_outcomes (np.ndarray): whether each row belongs to a
+                                             record with a long-term outcome
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray] | None: cell, age key and
+                tss key positions of each row, `None` if a row is off the grid
+                or in a cell the cube does not have
+        """
+        grid_index = []
+        for column, keys in (('age', self.age_keys), ('tss', self.tss_keys)):
+            row_keys = grid_keys(rows[column].to_numpy(dtype=float))
+            position = np.minimum(np.searchsorted(keys, row_keys), len(keys) - 1)
+            if len(keys) == 0 or not np.array_equal(keys[position], row_keys):
+                return None
+            grid_index.append(position)
+
+        # Cells are sorted by their codes, column by column, so numbering the
+        # code combinations in mixed radix keeps them sorted for the lookup
+        cell_numbers = np.zeros(len(self.long_term), dtype=np.int64)
+        row_numbers = np.zeros(len(rows), dtype=np.int64)
+        for column in self.columns:
+            codes = self.uniques[column].get_indexer(rows[column])
+            if ((codes < 0) & rows[column].notna().to_numpy()).any():
+                return None
+            radix = len(self.uniques[column]) + 1
+            cell_numbers = cell_numbers * radix + self.cell_codes[column] + 1
+            row_numbers = row_numbers * radix + codes + 1
+        cell_numbers = cell_numbers * 2 + self.long_term
+        row_numbers = row_numbers * 2 + long_term_outcomes
+        cell_index = np.minimum(np.searchsorted(cell_numbers, row_numbers), len(cell_numbers) - 1)
+        if not np.array_equal(cell_numbers[cell_index], row_numbers):
+            return None
+        return cell_index, grid_index[0], grid_index[1]
+
+    def _positions(self, variables: list[str]) -> np.ndarray:
+        """Returns the positions of the variables on the last axis"""
+        return np.array([self.variables.index(var) for var in variables], dtype=np.intp)
+
+
+def _grid_counts(rows: pd.DataFrame, cell_index: np.ndarray, age_index: np.ndarray,
+                 tss_index: np.ndarray, shape: tuple[int, int, int], variables: list[str],
+                 weights: np.ndarray | None = None) -> np.ndarray:
+    """Counts non-blank values per (cell, age key, tss key, variable)
+
+    Each row counts as its weight, 1 when `weights` is `None`.
+    """
+    n_cells, n_age, n_tss = shape
+    row_position, variable_position = np.nonzero(rows[variables].notna().to_numpy())
+    flat_index = ((cell_index * n_age + age_index) * n_tss + tss_index)[row_position]
+    flat_index = flat_index * len(variables) + variable_position
+    if weights is not None:
+        weights = weights[row_position]
+    counts = np.bincount(flat_index, weights=weights, minlength=n_cells * n_age * n_tss * len(variables))
+    return counts.astype(np.int64, copy=False).reshape(n_cells, n_age, n_tss, len(variables))
+
+
+def _accumulate(grid: np.ndarray) -> np.ndarray:
+    """Turns (cell, age, tss, variable) counts into 2D running sums, in place
+
+    One slice at a time is much faster than `cumsum` along the inner axes,
+    which walks the array with large strides.
+    """
+    for age in range(1, grid.shape[1]):
+        grid[:, age] += grid[:, age - 1]
+    for tss in range(1, grid.shape[2]):
+        grid[:, :, tss] += grid[:, :, tss - 1]
+    return grid
+
+
+def build_range_cube(df: pd.DataFrame, columns: list[str], variables: list[str],
+                     long_term_outcomes: np.ndarray | None = None,
+                     budget: int = CUBE_BUDGET) -> RangeCube | None:
+    """Builds the prefix-sum count cube of a dataframe
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        columns (list[str]): categorical filter columns to split the counts by
+        variables (list[str]): variables to count
+        long_term_outcomes (np.ndarray | None): precomputed rows of the records
+                                                with a long-term outcome
+        budget (int): largest prefix array to build, in bytes
+
+    Returns:
+        RangeCube | None: cube over every row, `None` when it exceeds the budget
+    """
+    if long_term_outcomes is None:
+        long_term_outcomes = long_term_outcome_mask(df)
+    age_keys, age_index = np.unique(grid_keys(df['age'].to_numpy(dtype=float)), return_inverse=True)
+    tss_keys, tss_index = np.unique(grid_keys(df['tss'].to_numpy(dtype=float)), return_inverse=True)
+
+    # Number the combinations of categorical values that occur in the data
+    uniques = {}
+    column_codes = []
+    for column in columns:
+        codes, uniques[column] = pd.factorize(df[column])
+        column_codes.append(codes)
+    column_codes.append(long_term_outcomes.astype(np.int64))
+    cell_keys, cell_index = np.unique(np.column_stack(column_codes), axis=0, return_inverse=True)
+    cell_index = cell_index.reshape(-1)
+    cell_codes = {column: cell_keys[:, i] for i, column in enumerate(columns)}
+    long_term = cell_keys[:, -1].astype(bool)
+
+    shape = (len(cell_keys), len(age_keys), len(tss_keys))
+    # Pad with a leading zero row and column so range starts need no special case
+    prefix_shape = (shape[0], shape[1] + 1, shape[2] + 1, len(variables))
+    dtype = np.min_scalar_type(len(df))
+    size = int(np.prod(prefix_shape)) * dtype.itemsize
+    if size > budget:
+        logger.info("Range cube of %d cells x %d ages x %d tss x %d variables would take %.1f MB, "
+                    "over the %.1f MB budget: counting from the rows", *shape, len(variables),
+                    size / 1e6, budget / 1e6)
+        return None
+    logger.info("Range cube: %d cells x %d ages x %d tss x %d variables, %.1f MB",
+                *shape, len(variables), size / 1e6)
+
+    counts = _grid_counts(df, cell_index, age_index.reshape(-1), tss_index.reshape(-1), shape, variables)
+    prefix = np.zeros(prefix_shape, dtype=dtype)
+    prefix[:, 1:, 1:] = counts
+    # Accumulate in the cube's dtype, no partial sum exceeds the row count
+    _accumulate(prefix[:, 1:, 1:])
+    return RangeCube(variables=list(variables), columns=list(columns), uniques=uniques,
+                     cell_codes=cell_codes, long_term=long_term, age_keys=age_keys, tss_keys=tss_keys,
+                     prefix=prefix)
+
+
+def patch_range_cube(cube: RangeCube, removed: pd.DataFrame, added: pd.DataFrame) -> RangeCube | None:
+    """Updates a cube for removed and added rows without rebuilding it
+
+    Counts are additive, so every removed row takes 1 off and every added row
+    adds 1 to the running sums at and past its grid position. Only the cells
+    the rows fall in are accumulated and updated, so the work follows the
+    number of changed records, not the size of the cube. This only works while
+    the added rows fall on the existing grid and cells. Rows are removed and
+    added by whole records, which keeps the long-term outcome flag of each
+    record computable from its own rows.
+
+    Args:
+        cube (RangeCube): cube to update, left as it is
+        removed (pd.DataFrame): rows of the records no longer in the dataframe
+        added (pd.DataFrame): rows of the records new in the dataframe
+
+    Returns:
+        RangeCube | None: updated cube, `None` if the added rows need new grid
+                          keys or cells, or more rows than its dtype holds
+    """
+    if removed.empty and added.empty:
+        return cube
+    rows = pd.concat([removed, added])
+    weights = np.repeat([-1, 1], [len(removed), len(added)])
+    long_term_outcomes = np.concatenate([long_term_outcome_mask(removed), long_term_outcome_mask(added)])
+
+    located = cube.locate(rows, long_term_outcomes)
+    if located is None:
+        return None
+    cell_index, age_index, tss_index = located
+
+    # Renumber the touched cells so the delta grid only spans them
+    touched, touched_index = np.unique(cell_index, return_inverse=True)
+    shape = (len(touched), len(cube.age_keys), len(cube.tss_keys))
+    delta = _accumulate(_grid_counts(rows, touched_index.reshape(-1), age_index, tss_index, shape,
+                                     cube.variables, weights))
+    # Checked in int64 before writing, the cube's dtype is unsigned and tight
+    updated = cube.prefix[touched, 1:, 1:].astype(np.int64) + delta
+    if updated.min(initial=0) < 0 or updated.max(initial=0) > np.iinfo(cube.prefix.dtype).max:
+        return None
+    # The loaded cube keeps serving queries until the swap, patch a copy
+    prefix = cube.prefix.copy()
+    prefix[touched, 1:, 1:] = updated
+    return RangeCube(variables=cube.variables, columns=cube.columns, uniques=cube.uniques,
+                     cell_codes=cube.cell_codes, long_term=cube.long_term, age_keys=cube.age_keys,
+                     tss_keys=cube.tss_keys, prefix=prefix)
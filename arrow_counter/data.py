@@ -0,0 +1,280 @@
+"""Loading and autofilling of the ARROW REDCap export."""
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.bitmap import NotnaBitmap, build_notna_bitmap
+from arrow_counter.cube import RangeCube, build_range_cube
+from arrow_counter.index import FilterIndex, build_filter_index
+from arrow_counter.patients import PatientIndex, build_patient_index
+from arrow_counter.readers import read_export
+from arrow_counter.schema import apply_schema
+from arrow_counter.sketch import APPROXIMATE_DISTINCT, DistinctSketches, build_distinct_sketches
+from arrow_counter.snapshot import file_digest, load_snapshot
+
+# Directory the REDCap exports are dropped into, the newest one is counted
+DATA_DIR = Path(os.getenv("ARROW_DATA_DIR", "."))
+
+# REDCap names its exports <project>_DATA_<yyyy-mm-dd_hhmm>.<xlsx|csv>
+EXPORT_PATTERN = re.compile(r"_DATA_(\d{4}-\d{2}-\d{2}_\d{4})\.(xlsx|csv)$", re.IGNORECASE)
+
+# Record-level columns that are only filled on a record's first row
+AUTOFILL_COLUMNS = ['sex_dashboard', 'graft_dashboard2', 'prior_aclr']
+
+# Define variables to count non-blank records
+VARIABLES = [
+    "insurance_dashboard_use", "ikdc", "pedi_ikdc", "marx", "pedi_fabs", "koos_pain",
+    "koos_sx", "koos_adl", "koos_sport", "koos_qol", "acl_rsi", "tsk", "rsi_score",
+    "rsi_emo", "rsi_con", "sh_lsi", "th_lsi", "ch_lsi", "lsi_ext_mvic_90",
+    "lsi_ext_mvic_60", "lsi_flex_mvic_60", "lsi_ext_isok_60", "lsi_flex_isok_60",
+    "lsi_ext_isok_90", "lsi_flex_isok_90", "lsi_ext_isok_180", "lsi_flex_isok_180",
+    "rts", "reinjury"]
+
+# Define timepoints for longitudinal filter in months
+# Make the timepoints one more than right bound so that we
+# are effectively flooring everything when organizing longitudinal
+# columns. Ex: 7.5 months tss becomes
+TIMEPOINTS = {
+    "3-4 months": (3, 5),
+    "5-7 months": (5, 8),
+    "8-12 months": (8, 13),
+    "13-24 months": (13, 25)
+}
+
+# Columns the dashboard reads, the only ones parsed from the export
+COLUMNS = ['record_id', *AUTOFILL_COLUMNS, 'age', 'tss', 'long_term_outcomes_complete', *VARIABLES]
+
+# Hash of each row as parsed, before autofill, stored with the snapshot so a
+# later export can be diffed against it record by record
+ROW_HASH_COLUMN = '_row_hash'
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """Loaded arrow dataset
+
+    Attributes:
+        frame (pd.DataFrame): autofilled arrow dataframe, shared and read-only
+        version (str): content hash of the export the frame was built from
+        source (str): path of the export the frame was built from
+        index (FilterIndex): row masks for the categorical filters
+        cube (RangeCube | None): prefix-sum counts for the age and tss ranges,
+                                 `None` when over `cube.CUBE_BUDGET`
+        notna (NotnaBitmap): bit-packed non-blank flags of `VARIABLES`
+        row_hashes (np.ndarray): hash of each row as parsed from the export
+        patients (PatientIndex): non-blank rows of `VARIABLES` by record, for
+                                 distinct patient counts
+        sketches (DistinctSketches | None): record id sketches of `VARIABLES`
+                                            for approximate distinct counts,
+                                            only built when they are enabled
+    """
+    frame: pd.DataFrame
+    version: str
+    source: str
+    index: FilterIndex
+    cube: RangeCube | None
+    notna: NotnaBitmap
+    row_hashes: np.ndarray
+    patients: PatientIndex
+    sketches: DistinctSketches | None = None
+
+    def notna_matrix(self, variables: list[str]) -> np.ndarray:
+        """Returns the non-blank matrix of the given variables
+
+        Args:
+            variables (list[str]): variables to select, in order
+
+        Returns:
+            np.ndarray: (row, variable) non-blank matrix
+        """
+        if self.notna.covers(variables):
+            return self.notna.unpack(variables)
+        return self.frame[variables].notna().to_numpy()
+
+
+def autofill(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """Function to fill missing values for each record id
+
+    Blank cells take the last value above them in the same record, or the
+    first value below them when the record has none above. Records are never
+    filled from each other. Rows are grouped by record once for all columns,
+    and each column is filled with vectorized scans over row positions.
+
+    Args:
+        df (pd.DataFrame): arrow dataset
+        columns (list[str]): list of columns to autofill
+
+    Returns:
+        pd.DataFrame: autofilled dataframe
+    """
+    n_rows = len(df)
+    record_ids = df['record_id']
+    if record_ids.is_monotonic_increasing:
+        # Exports list the records in order, group boundaries are where the
+        # id changes and nothing needs sorting
+        order = None
+        sorted_codes = record_ids.to_numpy()
+    else:
+        record_codes, _ = pd.factorize(record_ids)
+        # Stable sort keeps the visit order within each record
+        order = np.argsort(record_codes, kind='stable')
+        sorted_codes = record_codes[order]
+
+    positions = np.arange(n_rows, dtype=np.int32 if n_rows < 2**31 else np.int64)
+    is_first = np.ones(n_rows, dtype=bool)
+    is_first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_start = np.maximum.accumulate(np.where(is_first, positions, 0))
+    # Rows without a record id are left as they are
+    has_record = np.ones(n_rows, dtype=bool) if order is None else sorted_codes >= 0
+
+    for column in columns:
+        valid = df[column].notna().to_numpy()
+        if order is not None:
+            valid = valid[order]
+
+        # Forward fill: sorted position of the closest non-blank cell above,
+        # only kept when it belongs to the same record
+        source = np.where(valid, positions, -1)
+        np.maximum.accumulate(source, out=source)
+        blank = (source < group_start) & has_record
+        if blank.any():
+            # Backward fill the leading blanks of a record from its first
+            # non-blank cell, the only cells the forward fill cannot reach
+            below = np.where(valid, positions, n_rows)[::-1]
+            below = np.minimum.accumulate(below)[::-1]
+            same_record = below < n_rows
+            same_record[same_record] = sorted_codes[below[same_record]] == sorted_codes[same_record]
+            source[blank] = np.where(same_record[blank], below[blank], -1)
+        source[~has_record] = np.where(valid[~has_record], positions[~has_record], -1)
+
+        if order is not None:
+            # Back to the original row order, as original row positions
+            unsorted = np.empty_like(source)
+            unsorted[order] = np.where(source >= 0, order[source], -1)
+            source = unsorted
+        df[column] = pd.Series(df[column].array.take(source, allow_fill=True), index=df.index)
+    return df
+
+
+def parse_export(path: str | os.PathLike, columns: list[str] | None = COLUMNS) -> pd.DataFrame:
+    """parses the export, without autofilling it
+
+    Args:
+        path (str | os.PathLike): path to the Excel or REDCap CSV export
+        columns (list[str] | None): columns to parse, every column when `None`
+
+    Returns:
+        pd.DataFrame: arrow dataframe with the hash of every row in `ROW_HASH_COLUMN`
+    """
+    # Read with the fastest available backend. Large exports are only read by
+    # the streaming ones, which never hold the whole sheet in memory
+    data = read_export(path, columns)
+
+    # Convert 'tss' to numeric, forcing non-numeric values to NaN
+    data['tss'] = pd.to_numeric(data['tss'], errors='coerce')
+    # Hashed before the dtypes are compacted, which depend on the whole export
+    data[ROW_HASH_COLUMN] = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    # Compact dtypes, also making the autofill below work on categorical codes
+    return apply_schema(data)
+
+
+def parse_and_autofill(path: str | os.PathLike, columns: list[str] | None = COLUMNS) -> pd.DataFrame:
+    """parses the export and autofills it
+
+    Args:
+        path (str | os.PathLike): path to the Excel or REDCap CSV export
+        columns (list[str] | None): columns to parse, every column when `None`
+
+    Returns:
+        pd.DataFrame: autofilled arrow dataframe
+    """
+    data = parse_export(path, columns)
+    # Propagate values for sex_dashboard, graft_dashboard2, and prior_aclr so they are consistent throughout the record id
+    return autofill(data, AUTOFILL_COLUMNS)
+
+
+def snapshot_tag(columns: list[str] | None) -> str:
+    """Names the snapshot of an autofilled projection
+
+    Args:
+        columns (list[str] | None): projected columns, every column when `None`
+
+    Returns:
+        str: snapshot tag, distinct for every projection
+    """
+    if columns is None:
+        return "autofilled"
+    projection = hashlib.sha256("\0".join(columns).encode()).hexdigest()
+    return f"autofilled_{projection[:8]}"
+
+
+def latest_export(data_dir: Path = DATA_DIR) -> Path:
+    """Finds the newest REDCap export in a directory
+
+    Exports are ordered by the timestamp REDCap puts in their name, then by
+    modification time.
+
+    Args:
+        data_dir (Path): directory holding the exports
+
+    Returns:
+        Path: path of the newest export
+    """
+    exports = [path for path in Path(data_dir).iterdir()
+               if path.is_file() and EXPORT_PATTERN.search(path.name)]
+    if not exports:
+        raise FileNotFoundError(f"No REDCap export found in {data_dir}")
+    return max(exports, key=lambda path: (EXPORT_PATTERN.search(path.name).group(1),
+                                          path.stat().st_mtime_ns))
+
+
+def load_dataset(path: str | os.PathLike | None = None, columns: list[str] | None = COLUMNS) -> Dataset:
+    """loads the data
+
+    Args:
+        path (str | os.PathLike | None): path to the Excel or REDCap CSV export,
+                                         the newest export in `DATA_DIR` when `None`
+        columns (list[str] | None): columns to load, every column when `None`.
+                                    Must include the columns the counts use.
+
+    Returns:
+        Dataset: loaded arrow dataset
+    """
+    if path is None:
+        path = latest_export()
+    digest = file_digest(path)
+    # Load dataset from its columnar snapshot, parsing the Excel export only
+    # when it changed since the snapshot was written
+    frame = load_snapshot(path, partial(parse_and_autofill, columns=columns),
+                          tag=snapshot_tag(columns), digest=digest)
+    return build_dataset(frame, version=digest, source=str(path))
+
+
+def build_dataset(frame: pd.DataFrame, version: str, source: str) -> Dataset:
+    """Builds the indexes of an autofilled frame
+
+    Args:
+        frame (pd.DataFrame): autofilled arrow dataframe, with `ROW_HASH_COLUMN`
+        version (str): content hash of the export
+        source (str): path of the export
+
+    Returns:
+        Dataset: loaded arrow dataset
+    """
+    row_hashes = frame.pop(ROW_HASH_COLUMN).to_numpy()
+    # The autofilled columns are the categorical filters, index their values
+    index = build_filter_index(frame, AUTOFILL_COLUMNS)
+    cube = build_range_cube(frame, AUTOFILL_COLUMNS, VARIABLES, index.long_term_outcomes)
+    notna = build_notna_bitmap(frame[VARIABLES].notna().to_numpy(), VARIABLES)
+    patients = build_patient_index(frame, VARIABLES)
+    # The sketches share the cube's grid, without a cube counts stay exact
+    sketches = (build_distinct_sketches(frame, cube, VARIABLES, index.long_term_outcomes)
+                if APPROXIMATE_DISTINCT and cube is not None else None)
+    return Dataset(frame=frame, version=version, source=source, index=index, cube=cube,
+                   notna=notna, row_hashes=row_hashes, patients=patients, sketches=sketches)
@@ -0,0 +1,137 @@
+"""Incremental loading of a new REDCap export against the loaded dataset.
+
+Every export is a complete dump, but between two dumps only a few records
+change. The new export is still parsed in full, which is a streaming read, but
+it is then diffed against the loaded dataset record by record using the row
+hashes stored with the snapshot. Only the changed and added records are
+autofilled, and the filter index, count cube and non-blank matrix are patched
+for them instead of being rebuilt over every row.
+
+Autofill never crosses records, so a record whose rows are unchanged keeps
+exactly the autofilled rows it had.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from arrow_counter.bitmap import build_notna_bitmap
+from arrow_counter.cube import build_range_cube, patch_range_cube
+from arrow_counter.data import (AUTOFILL_COLUMNS, COLUMNS, ROW_HASH_COLUMN, VARIABLES, Dataset,
+                                autofill, latest_export, parse_export, snapshot_tag)
+from arrow_counter.index import patch_filter_index
+from arrow_counter.patients import build_patient_index
+from arrow_counter.sketch import APPROXIMATE_DISTINCT, build_distinct_sketches
+from arrow_counter.snapshot import file_digest, save_snapshot, snapshot_path
+
+logger = logging.getLogger(__name__)
+
+
+def record_hashes(record_ids: pd.Series, row_hashes: np.ndarray) -> pd.Series:
+    """Combines the row hashes of every record into one hash
+
+    The position of each row within its record is mixed in, so reordering the
+    visits of a record changes its hash, as it changes what autofill does.
+
+    Args:
+        record_ids (pd.Series): record id of each row
+        row_hashes (np.ndarray): hash of each row
+
+    Returns:
+        pd.Series: hash by record id, rows without a record id under NaN
+    """
+    codes, uniques = pd.factorize(record_ids, use_na_sentinel=False)
+    rank = pd.Series(codes).groupby(codes).cumcount().to_numpy(dtype=np.uint64)
+    mixed = row_hashes.astype(np.uint64) ^ pd.util.hash_array(rank)
+    combined = np.zeros(len(uniques), dtype=np.uint64)
+    # Wraps around on overflow, which is what a hash combination wants
+    np.add.at(combined, codes, mixed)
+    return pd.Series(combined, index=pd.Index(np.asarray(uniques)))
+
+
+def diff_records(old: pd.Series, new: pd.Series) -> tuple[pd.Index, pd.Index, pd.Index]:
+    """Compares the record hashes of two exports
+
+    Args:
+        old (pd.Series): record hashes of the loaded export
+        new (pd.Series): record hashes of the new export
+
+    Returns:
+        tuple[pd.Index, pd.Index, pd.Index]: changed, added and removed record ids
+    """
+    common = old.index.intersection(new.index)
+    changed = common[old[common].to_numpy() != new[common].to_numpy()]
+    return changed, new.index.difference(old.index), old.index.difference(new.index)
+
+
+def _concat_rows(kept: pd.DataFrame, added: pd.DataFrame) -> pd.DataFrame:
+    """Appends rows, merging the categories of categorical columns
+
+    `pd.concat` turns categoricals with different categories into objects.
+    """
+    columns = {}
+    for column in kept.columns:
+        if isinstance(kept[column].dtype, pd.CategoricalDtype) and \
+                isinstance(added[column].dtype, pd.CategoricalDtype):
+            columns[column] = pd.Series(union_categoricals([kept[column], added[column]]))
+        else:
+            columns[column] = pd.concat([kept[column], added[column]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def load_delta(dataset: Dataset, path: str | os.PathLike | None = None,
+               columns: list[str] | None = COLUMNS) -> Dataset:
+    """Loads a new export by patching the loaded dataset
+
+    Args:
+        dataset (Dataset): loaded dataset, loaded with the same `columns`
+        path (str | os.PathLike | None): path to the new Excel or REDCap CSV
+                                         export, the newest export in `DATA_DIR`
+                                         when `None`
+        columns (list[str] | None): columns to load, every column when `None`
+
+    Returns:
+        Dataset: dataset of the new export, the same rows as `load_dataset`
+                 would give but with the unchanged records first
+    """
+    if path is None:
+        path = latest_export()
+    digest = file_digest(path)
+    if digest == dataset.version:
+        return dataset
+
+    parsed = parse_export(path, columns)
+    old_ids = dataset.frame['record_id']
+    changed, added, removed = diff_records(record_hashes(old_ids, dataset.row_hashes),
+                                           record_hashes(parsed['record_id'], parsed[ROW_HASH_COLUMN].to_numpy()))
+    logger.info("Export %s: %d changed, %d added and %d removed records",
+                digest[:12], len(changed), len(added), len(removed))
+
+    keep = ~old_ids.isin(changed.append(removed)).to_numpy()
+    new_rows = parsed[parsed['record_id'].isin(changed.append(added)).to_numpy()].reset_index(drop=True)
+    new_rows = autofill(new_rows, AUTOFILL_COLUMNS)
+
+    kept_rows = dataset.frame[keep].reset_index(drop=True)
+    kept_rows[ROW_HASH_COLUMN] = dataset.row_hashes[keep]
+    frame = _concat_rows(kept_rows, new_rows[kept_rows.columns])
+    frame = save_snapshot(frame, snapshot_path(path, digest, snapshot_tag(columns)))
+    row_hashes = frame.pop(ROW_HASH_COLUMN).to_numpy()
+
+    index = patch_filter_index(dataset.index, keep, new_rows)
+    cube = None
+    if dataset.cube is not None:
+        cube = patch_range_cube(dataset.cube, dataset.frame[~keep], new_rows)
+    if cube is None:
+        # New ages, times or filter values are off the cube's grid, or the
+        # loaded dataset had none because it was over budget
+        cube = build_range_cube(frame, AUTOFILL_COLUMNS, VARIABLES, index.long_term_outcomes)
+    notna = build_notna_bitmap(np.concatenate([dataset.notna.unpack(VARIABLES)[keep],
+                                               new_rows[VARIABLES].notna().to_numpy()]), VARIABLES)
+    # Sketch registers only ever grow, removed records need a rebuild
+    sketches = (build_distinct_sketches(frame, cube, VARIABLES, index.long_term_outcomes)
+                if APPROXIMATE_DISTINCT and cube is not None else None)
+    return Dataset(frame=frame, version=digest, source=str(path), index=index, cube=cube,
+                   notna=notna, row_hashes=row_hashes, patients=build_patient_index(frame, VARIABLES),
+                   sketches=sketches)
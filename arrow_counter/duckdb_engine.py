@@ -0,0 +1,147 @@
+"""Embedded DuckDB database answering the counts under `ARROW_BACKEND=duckdb`.
+
+The dataset's frame is copied once into a DuckDB table, which its columnar
+storage and parallel scans query several times faster than the registered
+frame itself. Each query compiles the widget filters into one SQL aggregate,
+`COUNT(var)` per variable grouped by tss bucket, and the timepoints are summed
+from the buckets. DuckDB is optional and only imported when a backend is made.
+"""
+import threading
+
+import numpy as np
+
+from arrow_counter.backends import python_value
+from arrow_counter.cube import RANGE_COLUMNS
+from arrow_counter.data import Dataset
+from arrow_counter.timepoints import timepoint_counts, timepoint_edges
+
+# Name of the dataset's frame inside DuckDB
+TABLE = "arrow"
+
+
+def _identifier(name: str) -> str:
+    """Quotes a column name for SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def compile_query(cols: dict[str, list | tuple], variables: list[str], edges: np.ndarray,
+                  only_long_term_outcomes: bool = False) -> tuple[str, list]:
+    """Compiles the filters into one aggregate over tss buckets
+
+    Bucket i holds tss in [edges[i], edges[i + 1]), rows outside every bucket
+    or with a blank tss are grouped under NULL.
+
+    Args:
+        cols (dict[str, list | tuple]): filters by column, value lists for the
+                                        categorical columns and (low, high)
+                                        ranges for age and tss
+        variables (list[str]): columns to count
+        edges (np.ndarray): sorted bucket edges in months
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+    Returns:
+        tuple[str, list]: SQL query and its parameters
+    """
+    parameters = []
+    buckets = []
+    for position, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+        buckets.append(f"WHEN tss >= ? AND tss < ? THEN {position}")
+        parameters.extend([float(low), float(high)])
+    bucket = f"CASE {' '.join(buckets)} END" if buckets else "NULL"
+    counts = ", ".join(f"COUNT({_identifier(var)})" for var in variables)
+
+    conditions = []
+    for column, values in cols.items():
+        if column in RANGE_COLUMNS:
+            conditions.append(f"{_identifier(column)} BETWEEN ? AND ?")
+            parameters.extend(python_value(bound) for bound in values)
+        elif values:  # Only apply filter if values are not empty
+            conditions.append(f"{_identifier(column)} IN ({', '.join('?' * len(values))})")
+            parameters.extend(python_value(value) for value in values)
+    if only_long_term_outcomes:
+        conditions.append(f"record_id IN (SELECT record_id FROM {TABLE} "
+                          f"WHERE long_term_outcomes_complete IS NOT NULL)")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {bucket} AS bucket, {counts} FROM {TABLE}{where} GROUP BY bucket", parameters
+
+
+class DuckDBBackend:
+    """Embedded DuckDB database serving one dataset
+
+    The dataset is copied into an in-memory table when the backend is
+    created. A connection is not safe to share between threads, so queries
+    take turns.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset to register
+    """
+
+    def __init__(self, dataset: Dataset):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("ARROW_BACKEND=duckdb needs the duckdb package, install it "
+                              "or use the pandas backend") from None
+        self.version = dataset.version
+        self._connection = duckdb.connect()
+        self._connection.register("frame", dataset.frame)
+        self._connection.execute(f"CREATE TABLE {TABLE} AS SELECT * FROM frame")
+        self._connection.unregister("frame")
+        self._lock = threading.Lock()
+
+    def bucket_counts(self, cols: dict[str, list | tuple], variables: list[str], edges: np.ndarray,
+                      only_long_term_outcomes: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """Counts non-blank records per tss bucket
+
+        Args:
+            cols (dict[str, list | tuple]): filters by column
+            variables (list[str]): columns to count
+            edges (np.ndarray): sorted bucket edges in months
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (bucket, variable) counts and the
+                                           counts of the rows outside every bucket
+        """
+        query, parameters = compile_query(cols, variables, edges, only_long_term_outcomes)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        n_buckets = max(len(edges) - 1, 0)
+        counts = np.zeros((n_buckets + 1, len(variables)), dtype=np.int64)
+        for bucket, *bucket_counts in rows:
+            counts[n_buckets if bucket is None else bucket] = bucket_counts
+        return counts[:n_buckets], counts[n_buckets]
+
+    def count(self, cols: dict[str, list | tuple], variables: list[str],
+              only_long_term_outcomes: bool = False) -> dict[str, int]:
+        """Counts non-blank records for each variable given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): filters by column
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, int]: dictionary of non-blank counts
+        """
+        _, outside = self.bucket_counts(cols, variables, np.array([]), only_long_term_outcomes)
+        return dict(zip(variables, outside.tolist()))
+
+    def count_by_timepoint(self, cols: dict[str, list | tuple], timepoints: dict[str, tuple[int, int]],
+                           variables: list[str],
+                           only_long_term_outcomes: bool = False) -> dict[str, dict[str, int]]:
+        """Counts non-blank records for each variable and timepoint given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): filters by column
+            timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                     bound included, right excluded
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+        """
+        edges = timepoint_edges(timepoints)
+        bucket_counts, _ = self.bucket_counts(cols, variables, edges, only_long_term_outcomes)
+        return timepoint_counts(edges, bucket_counts, timepoints, variables)
@@ -0,0 +1,344 @@
+"""Counting engine shared by the dashboard pages.
+
+The engine owns the dataset: it is loaded once per process on first use and
+the same read-only frame is handed to every page and session afterwards,
+until `swap_dataset` replaces it with one built from a newer export.
+
+Queries the range cube cannot answer are counted under row masks by the
+pandas backend, or by DuckDB or Polars with `ARROW_BACKEND=duckdb` or
+`ARROW_BACKEND=polars`.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.backends import BackendCache
+from arrow_counter.bitmap import NotnaBitmap
+from arrow_counter.cube import RANGE_COLUMNS
+from arrow_counter.data import TIMEPOINTS, VARIABLES, Dataset, load_dataset
+from arrow_counter.duckdb_engine import DuckDBBackend
+from arrow_counter.index import FilterIndex, long_term_outcome_mask
+from arrow_counter.patients import build_patient_index
+from arrow_counter.polars_engine import PolarsBackend
+from arrow_counter.query_cache import QueryCache, query_key
+from arrow_counter.timepoints import timepoint_counts, timepoint_edges
+
+_dataset: Dataset | None = None
+_dataset_lock = threading.Lock()
+
+# Results of count_non_blank and count_by_timepoint, shared by all sessions
+query_cache = QueryCache()
+
+# Backend counting the queries the cube cannot answer
+BACKENDS = ('pandas', 'duckdb', 'polars')
+BACKEND = os.getenv("ARROW_BACKEND", "pandas")
+if BACKEND not in BACKENDS:
+    raise ValueError(f"ARROW_BACKEND must be one of {', '.join(BACKENDS)}, got {BACKEND!r}")
+
+# Copy of the latest dataset in each backend but pandas, made on first use
+_backends = {'duckdb': BackendCache(DuckDBBackend, "DuckDB"),
+             'polars': BackendCache(PolarsBackend, "Polars")}
+
+
+def dataset_loaded() -> bool:
+    """Returns `True` if the dataset is already loaded in this process."""
+    return _dataset is not None
+
+
+def get_dataset() -> Dataset:
+    """Returns the process-wide dataset, loading it on first use
+
+    Returns:
+        Dataset: loaded arrow dataset
+    """
+    global _dataset
+    if _dataset is None:
+        with _dataset_lock:
+            # Another thread may have loaded it while we waited on the lock
+            if _dataset is None:
+                _dataset = load_dataset()
+    return _dataset
+
+
+def swap_dataset(dataset: Dataset) -> Dataset | None:
+    """Replaces the process-wide dataset
+
+    The swap is a single reference assignment: queries already running keep
+    the dataset they started with and later calls to `get_dataset` see the
+    new one. Cached results of the old version are dropped.
+
+    Args:
+        dataset (Dataset): fully built dataset to serve from now on
+
+    Returns:
+        Dataset | None: dataset that was replaced
+    """
+    global _dataset
+    with _dataset_lock:
+        previous, _dataset = _dataset, dataset
+    if previous is not None and previous.version != dataset.version:
+        query_cache.invalidate(previous.version)
+    return previous
+
+
+def filter_mask(df: pd.DataFrame, cols: dict[str, list | tuple], only_long_term_outcomes: bool = False,
+                index: FilterIndex | None = None) -> np.ndarray:
+    """Combines every filter into one boolean row mask
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        cols (dict[str, list | tuple]): filters by column, value lists for the
+                                        categorical columns and (low, high)
+                                        ranges for age and tss
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+        index (FilterIndex | None): precomputed masks for the categorical and
+                                    long-term outcome filters of `df`, resolved
+                                    without scanning
+
+    Returns:
+        np.ndarray: boolean mask of the rows matching every filter
+    """
+    # Resolve every indexed categorical filter with one combined mask
+    mask = index.mask(cols) if index is not None else np.ones(len(df), dtype=bool)
+    # Check if we should only look at record_ids with long-term outcomes
+    if only_long_term_outcomes:
+        mask &= (index.long_term_outcomes if index is not None
+                 else long_term_outcome_mask(df))
+    for column, values in cols.items():  # Iterates through each filter
+        if index is not None and column in index.masks:
+            continue
+        if column in RANGE_COLUMNS:
+            mask &= df[column].between(values[0], values[1]).to_numpy()
+        elif values:  # Only apply filter if values are not empty
+            mask &= df[column].isin(values).to_numpy()
+    return mask
+
+
+def count_masked(df: pd.DataFrame, mask: np.ndarray, variables: list[str],
+                 notna: NotnaBitmap | None = None) -> dict[str, int]:
+    """Counts non-blank records for each variable among the masked rows
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        mask (np.ndarray): boolean mask of the rows to count
+        variables (list[str]): list of columns to display counts for
+        notna (NotnaBitmap | None): packed non-blank flags of `df`, counted
+                                    with popcount when they cover `variables`
+
+    Returns:
+        dict[str, int]: dictionary of non-blank counts
+    """
+    if notna is not None and notna.covers(variables):
+        return dict(zip(variables, notna.count(mask, variables).tolist()))
+    return {var: int(np.count_nonzero(df[var].notna().to_numpy() & mask)) for var in variables}
+
+
+def filter_count(df: pd.DataFrame, cols: dict[str, list | tuple], variables: list[str],
+                 only_long_term_outcomes: bool = False,
+                 index: FilterIndex | None = None) -> tuple[dict[str, int], pd.DataFrame]:
+    """Function applies filters and counts non-blank records for each variable
+
+    Callers that only need the counts should use `filter_mask` and
+    `count_masked`, which never copy the dataframe.
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        cols (dict[str, list | tuple]): filters by column, value lists for the
+                                        categorical columns and (low, high)
+                                        ranges for age and tss
+        variables (list[str]): list of columns to display counts for
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+        index (FilterIndex | None): precomputed masks for the categorical
+                                    filters of `df`, resolved without scanning
+
+    Returns:
+        tuple[dict[str, int], pd.DataFrame]: tuple of dictionary of non-blank counts
+                                             and the filtered dataframe 
+    """
+    mask = filter_mask(df, cols, only_long_term_outcomes, index)
+    return count_masked(df, mask, variables), df[mask]
+
+
+def longitudinal_filter(data: pd.DataFrame, timepoints: dict[str, tuple[int, int]], variables: list[str],
+                        mask: np.ndarray | None = None,
+                        notna: np.ndarray | NotnaBitmap | None = None) -> dict[str, dict[str, int]]:
+    """Function for longitudinal filter and count
+
+    tss is binned once against the edges of all timepoints and the timepoints
+    are summed from the counts per bin. Timepoints may overlap or leave gaps.
+    With a non-blank matrix the counts of every bin and variable come out of a
+    single bincount, so the cost does not grow with the number of bins. With
+    a `NotnaBitmap` each bin packs its own row mask and popcounts it, one pass
+    over the packed flags per bin.
+
+    Args:
+        data (pd.DataFrame): arrow dataframe
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+        variables (list[str]): list of columns to display counts
+        mask (np.ndarray | None): boolean mask of the rows of `data` to count,
+                                  all rows when not given
+        notna (np.ndarray | NotnaBitmap | None): precomputed (row, variable)
+                                                non-blank matrix of `data[variables]`,
+                                                or packed flags covering them
+
+    Returns:
+        dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+    """
+    if notna is None:
+        notna = data[variables].notna().to_numpy()
+
+    # Bin i holds tss in [edges[i], edges[i + 1]), blank tss falls past the last bin
+    edges = timepoint_edges(timepoints)
+    bins = np.searchsorted(edges, data['tss'].to_numpy(dtype=float), side='right') - 1
+    counted = (bins >= 0) & (bins < len(edges) - 1)
+    if mask is not None:
+        counted &= mask
+
+    n_vars = len(variables)
+    if isinstance(notna, NotnaBitmap):
+        # One AND and popcount over the packed flags per bin
+        bin_counts = np.array([notna.count(counted & (bins == b), variables)
+                               for b in range(len(edges) - 1)], dtype=np.int64).reshape(-1, n_vars)
+    else:
+        # One grouped reduction over every non-blank (row, variable) cell
+        rows, var_positions = np.nonzero(notna[counted])
+        bin_counts = np.bincount(bins[counted][rows] * n_vars + var_positions,
+                                 minlength=max(len(edges) - 1, 0) * n_vars).reshape(-1, n_vars)
+    return timepoint_counts(edges, bin_counts, timepoints, variables)
+
+
+def count_distinct(dataset: Dataset, mask: np.ndarray, variables: list[str]) -> dict[str, int]:
+    """Counts distinct patients with a non-blank value for each variable among the masked rows
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        mask (np.ndarray): boolean mask of the rows to count
+        variables (list[str]): list of columns to display counts for
+
+    Returns:
+        dict[str, int]: dictionary of distinct record id counts
+    """
+    patients = dataset.patients
+    if not patients.covers(variables):
+        patients = build_patient_index(dataset.frame, variables)
+    return patients.count(mask, variables)
+
+
+def longitudinal_distinct(dataset: Dataset, timepoints: dict[str, tuple[int, int]], variables: list[str],
+                          mask: np.ndarray) -> dict[str, dict[str, int]]:
+    """Counts distinct patients for each variable and timepoint among the masked rows
+
+    A patient with several visits in a timepoint counts once for it.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+        variables (list[str]): list of columns to display counts
+        mask (np.ndarray): boolean mask of the rows to count
+
+    Returns:
+        dict[str, dict[str, int]]: dictionary of variables and their distinct longitudinal counts
+    """
+    patients = dataset.patients
+    if not patients.covers(variables):
+        patients = build_patient_index(dataset.frame, variables)
+    return patients.count_by_timepoint(mask, dataset.frame['tss'].to_numpy(dtype=float), timepoints, variables)
+
+
+def row_backend(dataset: Dataset, backend: str = BACKEND) -> DuckDBBackend | PolarsBackend | None:
+    """Returns the configured backend for the queries the cube cannot answer
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        backend (str): one of `BACKENDS`
+
+    Returns:
+        DuckDBBackend | PolarsBackend | None: backend serving the dataset,
+                                              `None` for the pandas one
+    """
+    cache = _backends.get(backend)
+    return cache.get(dataset) if cache is not None else None
+
+
+def count_non_blank(dataset: Dataset, cols: dict[str, list | tuple], variables: list[str],
+                    only_long_term_outcomes: bool = False, distinct: bool = False) -> dict[str, int]:
+    """Counts non-blank records for each variable given the filters
+
+    Answers from the dataset's prefix-sum cube when it covers the query and
+    falls back to counting under a row mask, or with `BACKEND`, otherwise.
+    Results are memoized in `query_cache` and must not be modified.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        cols (dict[str, list | tuple]): filters by column
+        variables (list[str]): list of columns to display counts for
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+        distinct (bool): count distinct patients instead of rows, estimated
+                         from the dataset's sketches when it has them
+
+    Returns:
+        dict[str, int]: dictionary of non-blank counts
+    """
+    def compute() -> dict[str, int]:
+        if distinct:
+            if dataset.sketches is not None and dataset.sketches.can_answer(cols, variables):
+                return dataset.sketches.count(cols, variables, only_long_term_outcomes)
+            # Exact patient counts do not add up over cells, they need the rows
+            mask = filter_mask(dataset.frame, cols, only_long_term_outcomes, dataset.index)
+            return count_distinct(dataset, mask, variables)
+        if dataset.cube is not None and dataset.cube.can_answer(cols, variables):
+            return dataset.cube.count(cols, variables, only_long_term_outcomes)
+        backend = row_backend(dataset)
+        if backend is not None:
+            return backend.count(cols, variables, only_long_term_outcomes)
+        mask = filter_mask(dataset.frame, cols, only_long_term_outcomes, dataset.index)
+        return count_masked(dataset.frame, mask, variables, dataset.notna)
+
+    kind = "count_non_blank_distinct" if distinct else "count_non_blank"
+    key = query_key(dataset.version, kind, cols, variables, only_long_term_outcomes)
+    return query_cache.get_or_compute(key, compute)
+
+
+def count_by_timepoint(dataset: Dataset, cols: dict[str, list | tuple],
+                       timepoints: dict[str, tuple[int, int]], variables: list[str],
+                       only_long_term_outcomes: bool = False,
+                       distinct: bool = False) -> dict[str, dict[str, int]]:
+    """Counts non-blank records for each variable and timepoint given the filters
+
+    Answers from the dataset's prefix-sum cube when it covers the query and
+    falls back to `longitudinal_filter` under a row mask, or to `BACKEND`,
+    otherwise. Results are memoized in `query_cache` and must not be modified.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        cols (dict[str, list | tuple]): filters by column
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+        variables (list[str]): list of columns to display counts
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+        distinct (bool): count distinct patients instead of rows, estimated
+                         from the dataset's sketches when it has them
+
+    Returns:
+        dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+    """
+    def compute() -> dict[str, dict[str, int]]:
+        if distinct:
+            if dataset.sketches is not None and dataset.sketches.can_answer(cols, variables):
+                return dataset.sketches.count_by_timepoint(cols, timepoints, variables, only_long_term_outcomes)
+            mask = filter_mask(dataset.frame, cols, only_long_term_outcomes, dataset.index)
+            return longitudinal_distinct(dataset, timepoints, variables, mask)
+        if dataset.cube is not None and dataset.cube.can_answer(cols, variables):
+            return dataset.cube.count_by_timepoint(cols, timepoints, variables, only_long_term_outcomes)
+        backend = row_backend(dataset)
+        if backend is not None:
+            return backend.count_by_timepoint(cols, timepoints, variables, only_long_term_outcomes)
+        mask = filter_mask(dataset.frame, cols, only_long_term_outcomes, dataset.index)
+        return longitudinal_filter(dataset.frame, timepoints, variables, mask,
+                                   dataset.notna if dataset.notna.covers(variables) else None)
+
+    kind = "count_by_timepoint_distinct" if distinct else "count_by_timepoint"
+    key = query_key(dataset.version, kind, cols, variables,
+                    only_long_term_outcomes, timepoints)
+    return query_cache.get_or_compute(key, compute)
@@ -0,0 +1,107 @@
+"""Precomputed row masks for the categorical filters."""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class FilterIndex:
+    """One boolean row mask per value of each indexed categorical column
+
+    Attributes:
+        masks (dict[str, dict[object, np.ndarray]]): row masks by column and value
+        n_rows (int): number of rows in the indexed dataframe
+        long_term_outcomes (np.ndarray): rows of the records with a long-term outcome
+    """
+    masks: dict[str, dict[object, np.ndarray]]
+    n_rows: int
+    long_term_outcomes: np.ndarray
+
+    def mask(self, cols: dict[str, list | tuple]) -> np.ndarray:
+        """Combines the selected values of every indexed filter into one mask
+
+        Values selected within a column are OR-ed together and the columns are
+        AND-ed, which matches chaining `isin` filters. Filters on columns that
+        are not indexed and empty selections are ignored.
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column
+
+        Returns:
+            np.ndarray: boolean row mask aligned with the indexed dataframe
+        """
+        combined = np.ones(self.n_rows, dtype=bool)
+        for column, values in cols.items():
+            if column not in self.masks or not values:
+                continue
+            column_mask = np.zeros(self.n_rows, dtype=bool)
+            for value in values:
+                value_mask = self.masks[column].get(value)
+                if value_mask is not None:
+                    column_mask |= value_mask
+            combined &= column_mask
+        return combined
+
+
+def long_term_outcome_mask(df: pd.DataFrame) -> np.ndarray:
+    """Flags every row of the records with at least one long-term outcome
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+
+    Returns:
+        np.ndarray: boolean row mask, `False` for rows without a record id
+    """
+    codes, uniques = pd.factorize(df['record_id'])
+    has_outcome = df['long_term_outcomes_complete'].notna().to_numpy() & (codes >= 0)
+    record_has_outcome = np.zeros(len(uniques), dtype=bool)
+    record_has_outcome[codes[has_outcome]] = True
+    return record_has_outcome[codes] & (codes >= 0)
+
+
+def build_filter_index(df: pd.DataFrame, columns: list[str]) -> FilterIndex:
+    """Builds the row masks for every value of the given columns
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        columns (list[str]): categorical columns to index
+
+    Returns:
+        FilterIndex: index over the dataframe's rows
+    """
+    masks = {}
+    for column in columns:
+        # Blank cells get code -1 and never match a selection
+        codes, uniques = pd.factorize(df[column])
+        masks[column] = {value: codes == code for code, value in enumerate(uniques)}
+    return FilterIndex(masks=masks, n_rows=len(df),
+                       long_term_outcomes=long_term_outcome_mask(df))
+
+
+def patch_filter_index(index: FilterIndex, keep: np.ndarray, added: pd.DataFrame) -> FilterIndex:
+    """Updates an index for a frame made of kept rows followed by added rows
+
+    The long-term outcome flag is per record, so `added` must hold every row of
+    the records it contains.
+
+    Args:
+        index (FilterIndex): index of the previous frame
+        keep (np.ndarray): boolean mask of the previous frame's rows that are kept
+        added (pd.DataFrame): rows appended after the kept rows
+
+    Returns:
+        FilterIndex: index over the kept and added rows
+    """
+    n_kept = int(keep.sum())
+    masks = {}
+    for column, value_masks in index.masks.items():
+        codes, uniques = pd.factorize(added[column])
+        added_masks = {value: codes == code for code, value in enumerate(uniques)}
+        masks[column] = {}
+        for value in {**value_masks, **added_masks}:
+            kept = value_masks[value][keep] if value in value_masks else np.zeros(n_kept, dtype=bool)
+            new = added_masks.get(value, np.zeros(len(added), dtype=bool))
+            masks[column][value] = np.concatenate([kept, new])
+    long_term_outcomes = np.concatenate([index.long_term_outcomes[keep], long_term_outcome_mask(added)])
+    return FilterIndex(masks=masks, n_rows=n_kept + len(added), long_term_outcomes=long_term_outcomes)
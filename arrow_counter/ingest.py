@@ -0,0 +1,186 @@
+"""Streaming ingestion of the Excel export with bounded memory.
+
+`pd.read_excel` builds openpyxl's whole in-memory workbook before any frame
+exists, which peaks at many times the size of the data. This walks the sheet
+row by row (openpyxl's read-only mode or any other row reader) and writes the
+projected columns to an Arrow IPC file in fixed-size typed chunks, so only one
+chunk of Python objects is alive at a time.
+"""
+import logging
+import math
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+
+from arrow_counter.schema import FLOAT32_COLUMNS, INT8_COLUMNS
+from arrow_counter.snapshot import SNAPSHOT_DIR, read_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Rows converted and written at a time
+CHUNK_ROWS = 50_000
+
+# Columns stored as float64, every other column is stored as text
+NUMERIC_COLUMNS = ['age', 'tss', *INT8_COLUMNS, *FLOAT32_COLUMNS]
+
+
+def _number(value) -> float:
+    """Converts a cell to a float, blank or non-numeric cells become NaN"""
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _text(value) -> str | None:
+    """Converts a cell to text, keeping blank cells blank"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # Readers that return every number as a float, e.g. an id 12 as 12.0
+        return str(int(value))
+    return str(value)
+
+
+def openpyxl_rows(path: str | os.PathLike) -> Iterator[tuple]:
+    """Yields the rows of the first sheet of a workbook, header first, in read-only mode
+
+    Args:
+        path (str | os.PathLike): path to the Excel export
+
+    Yields:
+        tuple: cell values of the next row
+    """
+    # Imported here, only reading an Excel export needs it and it is slow to import
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_chunks(rows: Iterator[tuple], columns: list[str] | None = None,
+                chunk_rows: int = CHUNK_ROWS,
+                numeric_columns: list[str] = NUMERIC_COLUMNS) -> Iterator[pa.RecordBatch]:
+    """Converts a stream of sheet rows to typed record batches
+
+    Args:
+        rows (Iterator[tuple]): cell values of each row, header first
+        columns (list[str] | None): columns to keep, every column when `None`
+        chunk_rows (int): number of rows per batch
+        numeric_columns (list[str]): columns stored as float64 instead of text
+
+    Yields:
+        pa.RecordBatch: next `chunk_rows` rows of the projected columns
+    """
+    header = [str(name) for name in next(rows)]
+    columns = header if columns is None else columns
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f"Columns missing from the export: {missing}")
+    positions = [header.index(column) for column in columns]
+    numeric = set(numeric_columns)
+    schema = pa.schema([(column, pa.float64() if column in numeric else pa.string())
+                        for column in columns])
+    converters = [_number if column in numeric else _text for column in columns]
+
+    def to_batch(buffers: list[list]) -> pa.RecordBatch:
+        arrays = [pa.array(buffer, type=field.type) for buffer, field in zip(buffers, schema)]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    buffers = [[] for _ in columns]
+    for row in rows:
+        # Skip the empty rows some readers report past the end of the data
+        if all(cell is None or cell == "" for cell in row):
+            continue
+        for buffer, position, convert in zip(buffers, positions, converters):
+            buffer.append(convert(row[position] if position < len(row) else None))
+        if len(buffers[0]) >= chunk_rows:
+            yield to_batch(buffers)
+            buffers = [[] for _ in columns]
+    if buffers[0]:
+        yield to_batch(buffers)
+
+
+def ingest_rows(rows: Iterator[tuple], destination: Path, columns: list[str] | None = None,
+                chunk_rows: int = CHUNK_ROWS, source: str = "export",
+                progress: Callable[[int, float], None] | None = None) -> int:
+    """Streams sheet rows into an Arrow IPC file
+
+    Args:
+        rows (Iterator[tuple]): cell values of each row, header first
+        destination (Path): Arrow IPC file to write
+        columns (list[str] | None): columns to keep, every column when `None`
+        chunk_rows (int): number of rows converted and written at a time
+        source (str): name of the export, for the progress log
+        progress (Callable[[int, float], None] | None): called after every chunk
+            with the rows ingested so far and the rows per second
+
+    Returns:
+        int: number of rows ingested
+    """
+    start = time.perf_counter()
+    n_rows = 0
+    writer = None
+    try:
+        for batch in iter_chunks(rows, columns, chunk_rows):
+            if writer is None:
+                writer = pa.ipc.new_file(destination, batch.schema)
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+            rows_per_sec = n_rows / max(time.perf_counter() - start, 1e-9)
+            logger.info("Ingested %d rows from %s (%.0f rows/s)", n_rows, source, rows_per_sec)
+            if progress is not None:
+                progress(n_rows, rows_per_sec)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def _temp_arrow_file() -> Path:
+    """Creates the temporary Arrow file of a streamed read
+
+    It goes next to the snapshots, which are on disk, and to the system temp
+    directory when the snapshot directory cannot be written to.
+    """
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(suffix=".arrow.tmp", dir=SNAPSHOT_DIR)
+    except OSError:
+        # Read-only filesystem: the export can still be read
+        fd, tmp_name = tempfile.mkstemp(suffix=".arrow.tmp")
+    os.close(fd)
+    return Path(tmp_name)
+
+
+def read_rows_streaming(rows: Iterator[tuple], columns: list[str] | None = None,
+                        chunk_rows: int = CHUNK_ROWS, source: str = "export") -> pd.DataFrame:
+    """Reads sheet rows through a streamed, memory-mapped Arrow file
+
+    Args:
+        rows (Iterator[tuple]): cell values of each row, header first
+        columns (list[str] | None): columns to keep, every column when `None`
+        chunk_rows (int): number of rows converted and written at a time
+        source (str): name of the export, for the progress log
+
+    Returns:
+        pd.DataFrame: projected columns, numbers as float64 and the rest as text
+    """
+    tmp_path = _temp_arrow_file()
+    try:
+        if ingest_rows(rows, tmp_path, columns, chunk_rows, source) == 0:
+            # Header only, nothing was written
+            return pd.DataFrame({column: [] for column in (columns or [])})
+        return read_snapshot(tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
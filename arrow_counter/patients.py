@@ -0,0 +1,167 @@
+"""Distinct patient counts, each record id counted once.
+
+Row counts add up over the cube's cells but patient counts do not, so they are
+counted from the rows under the filter mask. For every variable the index keeps
+the positions of its non-blank rows, sorted by record code. The rows left
+after applying a mask are then still grouped by record, and the number of
+patients is the number of places where the record code changes: one gather and
+one comparison per non-blank cell, without sorting or hashing at query time.
+
+Within a record the rows are also sorted by tss, and the index keeps the
+position of each row's tss on the range cube's grid of tss keys. A timepoint
+with integer bounds is a range of those positions, so one lookup gives every
+kept row its timepoint, the rows of a record in the same timepoint sit next to
+each other, and one pass over the changes of (record, timepoint) counts every
+timepoint, like `longitudinal_filter` does for row counts.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.cube import grid_keys, is_integer
+
+
+@dataclass(frozen=True)
+class PatientIndex:
+    """Non-blank rows of each variable grouped by record
+
+    Attributes:
+        variables (list[str]): indexed variables
+        rows (list[np.ndarray]): positions of each variable's non-blank rows
+                                 that have a record id, sorted by record code
+                                 and then by tss
+        records (list[np.ndarray]): record code of each of those rows
+        tss_keys (np.ndarray): sorted tss grid keys, see `cube.grid_keys`
+        tss_positions (list[np.ndarray]): position of each of those rows' tss
+                                          in `tss_keys`
+        n_records (int): number of distinct record ids
+    """
+    variables: list[str]
+    rows: list[np.ndarray]
+    records: list[np.ndarray]
+    tss_keys: np.ndarray
+    tss_positions: list[np.ndarray]
+    n_records: int
+
+    def covers(self, variables: list[str]) -> bool:
+        """Returns `True` if every variable is indexed."""
+        return set(variables) <= set(self.variables)
+
+    def count(self, mask: np.ndarray, variables: list[str]) -> dict[str, int]:
+        """Counts the distinct records with a non-blank row of each variable under a row mask
+
+        Args:
+            mask (np.ndarray): boolean row mask
+            variables (list[str]): indexed variables to count
+
+        Returns:
+            dict[str, int]: distinct record count per variable
+        """
+        counts = {}
+        for var in variables:
+            position = self.variables.index(var)
+            counts[var] = _distinct(self.records[position][mask[self.rows[position]]])
+        return counts
+
+    def count_by_timepoint(self, mask: np.ndarray, tss: np.ndarray, timepoints: dict[str, tuple[int, int]],
+                           variables: list[str]) -> dict[str, dict[str, int]]:
+        """Counts distinct records for each variable and timepoint under a row mask
+
+        A record with several rows in a timepoint counts once for it.
+
+        Args:
+            mask (np.ndarray): boolean row mask
+            tss (np.ndarray): time since surgery of every row, in months
+            timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                     bound included, right excluded
+            variables (list[str]): indexed variables to count
+
+        Returns:
+            dict[str, dict[str, int]]: distinct record counts by variable and timepoint
+        """
+        if not all(is_integer(bound) for tp_range in timepoints.values() for bound in tp_range):
+            return self._count_by_tss(mask, tss, timepoints, variables)
+        # Grid positions of each timepoint, keys 2 * low up to 2 * high excluded
+        ranges = [tuple(np.searchsorted(self.tss_keys, [2 * tp_low, 2 * tp_high]).tolist())
+                  for tp_low, tp_high in timepoints.values()]
+        # Timepoint of every grid position, len(timepoints) outside all of them
+        position_timepoints = np.full(len(self.tss_keys), len(timepoints), dtype=np.int8)
+        for tp, (start, end) in enumerate(ranges):
+            if np.any(position_timepoints[start:end] < len(timepoints)):
+                # A row can fall in several timepoints, count them one by one
+                return self._count_by_position(mask, ranges, timepoints, variables)
+            position_timepoints[start:end] = tp
+
+        counts = {}
+        for var in variables:
+            position = self.variables.index(var)
+            kept = mask[self.rows[position]]
+            records = self.records[position][kept]
+            row_timepoints = np.take(position_timepoints, self.tss_positions[position][kept])
+            first = np.ones(len(records), dtype=bool)
+            first[1:] = (records[1:] != records[:-1]) | (row_timepoints[1:] != row_timepoints[:-1])
+            # Timepoint of each (record, timepoint) group, cheaper to compare than to bincount
+            group_timepoints = row_timepoints[first]
+            counts[var] = {tp_label: int(np.count_nonzero(group_timepoints == tp))
+                           for tp, tp_label in enumerate(timepoints)}
+        return counts
+
+    def _count_by_position(self, mask: np.ndarray, ranges: list[tuple[int, int]],
+                           timepoints: dict[str, tuple[int, int]], variables: list[str]) -> dict[str, dict[str, int]]:
+        """Counts overlapping timepoints one by one from their grid positions"""
+        counts = {var: {} for var in variables}
+        for var in variables:
+            position = self.variables.index(var)
+            kept = mask[self.rows[position]]
+            records, tss_positions = self.records[position][kept], self.tss_positions[position][kept]
+            for tp_label, (start, end) in zip(timepoints, ranges):
+                counts[var][tp_label] = _distinct(records[(tss_positions >= start) & (tss_positions < end)])
+        return counts
+
+    def _count_by_tss(self, mask: np.ndarray, tss: np.ndarray, timepoints: dict[str, tuple[int, int]],
+                      variables: list[str]) -> dict[str, dict[str, int]]:
+        """Counts timepoints with fractional bounds one by one from the rows' tss"""
+        counts = {var: {} for var in variables}
+        for var in variables:
+            position = self.variables.index(var)
+            kept = mask[self.rows[position]]
+            records = self.records[position][kept]
+            var_tss = tss[self.rows[position][kept]]
+            for tp_label, (tp_low, tp_high) in timepoints.items():
+                counts[var][tp_label] = _distinct(records[(var_tss >= tp_low) & (var_tss < tp_high)])
+        return counts
+
+
+def _distinct(records: np.ndarray) -> int:
+    """Counts the distinct codes of an array grouped by code"""
+    return int(len(records) > 0) + int(np.count_nonzero(records[1:] != records[:-1]))
+
+
+def build_patient_index(df: pd.DataFrame, variables: list[str]) -> PatientIndex:
+    """Indexes the non-blank rows of every variable by record
+
+    Args:
+        df (pd.DataFrame): arrow dataframe
+        variables (list[str]): variables to index
+
+    Returns:
+        PatientIndex: index over the dataframe's rows
+    """
+    codes, record_ids = pd.factorize(df['record_id'])
+    codes = codes.astype(np.int32)
+    tss_keys, tss_positions = np.unique(grid_keys(df['tss'].to_numpy(dtype=float)), return_inverse=True)
+    position_dtype = np.int32 if len(df) < 2**31 else np.int64
+    # Rows with a record id by record code, then tss, blank tss last
+    order = np.flatnonzero(codes >= 0)
+    order = order[np.lexsort((tss_positions[order], codes[order]))].astype(position_dtype)
+    tss_positions = tss_positions.astype(np.int16 if len(tss_keys) < 2**15 else np.int32)
+
+    rows, records, row_tss_positions = [], [], []
+    for var in variables:
+        var_rows = order[df[var].notna().to_numpy()[order]]
+        rows.append(var_rows)
+        records.append(codes[var_rows])
+        row_tss_positions.append(tss_positions[var_rows])
+    return PatientIndex(variables=list(variables), rows=rows, records=records, tss_keys=tss_keys,
+                        tss_positions=row_tss_positions, n_records=len(record_ids))
@@ -0,0 +1,165 @@
+"""Lazy Polars plans answering the counts under `ARROW_BACKEND=polars`.
+
+The dataset is converted to a Polars frame once. Every query is then one lazy
+plan: the filters become a single predicate, the optimizer reads only the
+columns it filters and counts, and a single group-by over the tss buckets
+counts every variable on all cores. Polars is optional and only imported when
+a backend is made or a plan is built.
+"""
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from arrow_counter.backends import python_value
+from arrow_counter.cube import RANGE_COLUMNS
+from arrow_counter.data import Dataset
+from arrow_counter.timepoints import timepoint_counts, timepoint_edges
+
+if TYPE_CHECKING:
+    import polars as pl
+
+
+def _polars():
+    """Imports Polars, which only this backend needs"""
+    try:
+        import polars
+    except ImportError:
+        raise ImportError("ARROW_BACKEND=polars needs the polars package, install it "
+                          "or use the pandas backend") from None
+    return polars
+
+
+def filter_expression(cols: dict[str, list | tuple], only_long_term_outcomes: bool = False) -> "pl.Expr":
+    """Combines every filter into one predicate
+
+    Args:
+        cols (dict[str, list | tuple]): filters by column, value lists for the
+                                        categorical columns and (low, high)
+                                        ranges for age and tss
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+    Returns:
+        pl.Expr: predicate of the rows matching every filter
+    """
+    pl = _polars()
+    predicate = pl.lit(True)
+    for column, values in cols.items():
+        if column in RANGE_COLUMNS:
+            low, high = (python_value(bound) for bound in values)
+            predicate &= pl.col(column).is_between(low, high, closed='both')
+        elif values:  # Only apply filter if values are not empty
+            predicate &= pl.col(column).is_in([python_value(value) for value in values])
+    if only_long_term_outcomes:
+        # Evaluated over the whole frame, before any other filter drops rows
+        predicate &= (pl.col('record_id').is_not_null()
+                      & pl.col('long_term_outcomes_complete').is_not_null().any().over('record_id'))
+    return predicate.fill_null(False)
+
+
+def bucket_expression(edges: np.ndarray) -> "pl.Expr":
+    """Numbers the tss bucket of every row, null outside every bucket
+
+    Bucket i holds tss in [edges[i], edges[i + 1]).
+    """
+    pl = _polars()
+    if len(edges) < 2:
+        return pl.lit(None, dtype=pl.Int32).alias('bucket')
+    tss = pl.col('tss')
+    bucket = pl.when((tss >= float(edges[0])) & (tss < float(edges[1]))).then(pl.lit(0, dtype=pl.Int32))
+    for position, (low, high) in enumerate(zip(edges[1:-1], edges[2:]), start=1):
+        bucket = bucket.when((tss >= float(low)) & (tss < float(high))).then(pl.lit(position, dtype=pl.Int32))
+    return bucket.alias('bucket')
+
+
+def bucket_counts(frame: "pl.LazyFrame", cols: dict[str, list | tuple], variables: list[str],
+                  edges: np.ndarray, only_long_term_outcomes: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """Counts non-blank records per tss bucket with one lazy plan
+
+    Args:
+        frame (pl.LazyFrame): autofilled arrow dataset
+        cols (dict[str, list | tuple]): filters by column
+        variables (list[str]): columns to count
+        edges (np.ndarray): sorted bucket edges in months
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (bucket, variable) counts and the counts
+                                       of the rows outside every bucket
+    """
+    pl = _polars()
+    counts_by_bucket = (frame
+                        .filter(filter_expression(cols, only_long_term_outcomes))
+                        .group_by(bucket_expression(edges))
+                        .agg(pl.col(var).count() for var in variables)
+                        .collect())
+    n_buckets = max(len(edges) - 1, 0)
+    counts = np.zeros((n_buckets + 1, len(variables)), dtype=np.int64)
+    buckets = counts_by_bucket['bucket'].fill_null(n_buckets).to_numpy()
+    counts[buckets] = counts_by_bucket.select(variables).to_numpy()
+    return counts[:n_buckets], counts[n_buckets]
+
+
+def longitudinal_filter(frame: "pl.LazyFrame", timepoints: dict[str, tuple[int, int]], variables: list[str],
+                        cols: dict[str, list | tuple] | None = None,
+                        only_long_term_outcomes: bool = False) -> dict[str, dict[str, int]]:
+    """Filters and counts non-blank records for each variable and timepoint
+
+    Args:
+        frame (pl.LazyFrame): autofilled arrow dataset
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+        variables (list[str]): list of columns to display counts
+        cols (dict[str, list | tuple] | None): filters by column, none when not given
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+    Returns:
+        dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+    """
+    edges = timepoint_edges(timepoints)
+    counts, _ = bucket_counts(frame, cols or {}, variables, edges, only_long_term_outcomes)
+    return timepoint_counts(edges, counts, timepoints, variables)
+
+
+class PolarsBackend:
+    """Polars copy of one dataset answering count queries
+
+    Args:
+        dataset (Dataset): loaded arrow dataset to convert
+    """
+
+    def __init__(self, dataset: Dataset):
+        pl = _polars()
+        self.version = dataset.version
+        # Converted once, NaN becomes null so `count` skips blanks like `notna`
+        self.frame = pl.from_pandas(dataset.frame, nan_to_null=True)
+
+    def count(self, cols: dict[str, list | tuple], variables: list[str],
+              only_long_term_outcomes: bool = False) -> dict[str, int]:
+        """Counts non-blank records for each variable given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): filters by column
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, int]: dictionary of non-blank counts
+        """
+        _, outside = bucket_counts(self.frame.lazy(), cols, variables, np.array([]), only_long_term_outcomes)
+        return dict(zip(variables, outside.tolist()))
+
+    def count_by_timepoint(self, cols: dict[str, list | tuple], timepoints: dict[str, tuple[int, int]],
+                           variables: list[str],
+                           only_long_term_outcomes: bool = False) -> dict[str, dict[str, int]]:
+        """Counts non-blank records for each variable and timepoint given the filters
+
+        Args:
+            cols (dict[str, list | tuple]): filters by column
+            timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                     bound included, right excluded
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+        """
+        return longitudinal_filter(self.frame.lazy(), timepoints, variables, cols, only_long_term_outcomes)
@@ -0,0 +1,114 @@
+"""Process-wide memo of query results.
+
+Clinicians keep switching between the same few filter combinations. Results
+are cached per dataset version under a canonical form of the filters, so the
+same query asked by any user, in any order of selection, is computed once.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+# Number of query results kept before the least recently used one is evicted
+QUERY_CACHE_SIZE = int(os.getenv("ARROW_QUERY_CACHE_SIZE", "512"))
+
+
+def _canonical_value(value):
+    """Makes equal filter values compare and sort the same (1, 1.0, True)"""
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    return value
+
+
+def query_key(version: str, kind: str, cols: dict[str, list | tuple], variables: list[str],
+              only_long_term_outcomes: bool = False,
+              timepoints: dict[str, tuple[int, int]] | None = None) -> tuple:
+    """Builds the canonical cache key of a query
+
+    Selections are deduplicated and sorted and empty selections dropped, since
+    an empty multiselect does not filter. Range filters keep their (low, high)
+    order.
+
+    Args:
+        version (str): version of the dataset the query runs on
+        kind (str): name of the query, e.g. which engine function answers it
+        cols (dict[str, list | tuple]): filters by column
+        variables (list[str]): counted variables
+        only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+        timepoints (dict[str, tuple[int, int]] | None): timepoints of a longitudinal query
+
+    Returns:
+        tuple: hashable key
+    """
+    filters = []
+    for column, values in sorted(cols.items()):
+        if column in ('age', 'tss'):
+            filters.append((column, tuple(float(bound) for bound in values)))
+        elif values:
+            canonical = {_canonical_value(value) for value in values}
+            filters.append((column, tuple(sorted(canonical, key=lambda v: (type(v).__name__, v)))))
+    timepoint_key = tuple(timepoints.items()) if timepoints is not None else None
+    return (version, kind, tuple(filters), tuple(variables), bool(only_long_term_outcomes), timepoint_key)
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results with hit and miss counters
+
+    Cached results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], object]):
+        """Returns the cached result for a key, computing and storing it on a miss
+
+        Args:
+            key (Hashable): key built by `query_key`
+            compute (Callable[[], object]): computes the result on a miss
+
+        Returns:
+            object: cached or freshly computed result
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        # Compute outside the lock so slow queries do not block cache hits
+        result = compute()
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, version: str | None = None) -> None:
+        """Drops the cached results of one dataset version, or all of them
+
+        Args:
+            version (str | None): dataset version to drop, everything when not given
+        """
+        with self._lock:
+            if version is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == version]:
+                    del self._entries[key]
+
+    def stats(self) -> dict[str, int]:
+        """Returns the hit, miss and size counters
+
+        Returns:
+            dict[str, int]: cache counters
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "max_entries": self.max_entries}
@@ -0,0 +1,221 @@
+"""Pluggable readers for the REDCap export.
+
+Every reader returns the projected columns in the same shape as the streaming
+ingest: numbers as float64 and everything else as text. The Rust-backed
+calamine reader is used when `python-calamine` is installed, REDCap CSV
+exports are read directly, and openpyxl is the fallback that always works.
+
+Calamine loads the whole sheet, every column of it, before yielding a row,
+so it does not keep the bounded memory of the openpyxl streaming path. It is
+only considered for exports up to `STREAMING_THRESHOLD` bytes; larger ones
+are read by the streaming readers.
+
+When more than one reader can read an export, the first parse in the process
+times each of them on its first `BENCHMARK_ROWS` rows, then parses the whole
+export once with the fastest and uses that reader from then on. Setting
+`ARROW_READER` to a reader name skips the benchmark and the size limit.
+"""
+import importlib.util
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.ingest import CHUNK_ROWS, NUMERIC_COLUMNS, openpyxl_rows, read_rows_streaming
+
+logger = logging.getLogger(__name__)
+
+# Reader forced by configuration, the benchmark picks one when not set
+READER_OVERRIDE = os.getenv("ARROW_READER")
+
+# Exports larger than this many bytes are only read by streaming readers
+STREAMING_THRESHOLD = int(os.getenv("ARROW_STREAMING_THRESHOLD", str(8 << 20)))
+
+# Rows each reader parses in the benchmark, the sample frames are discarded
+BENCHMARK_ROWS = 2_000
+
+
+@dataclass(frozen=True)
+class Reader:
+    """Export reader backend
+
+    Attributes:
+        name (str): name used in logs and in `ARROW_READER`
+        suffixes (tuple[str, ...]): file suffixes the reader handles
+        available (Callable[[], bool]): whether the reader's dependencies are installed
+        read (Callable[[str | os.PathLike, list[str] | None, int | None], pd.DataFrame]):
+            reads the projected columns of an export, only its first rows
+            when given a row count
+        streams (bool): whether memory stays bounded by the projected columns
+                        instead of growing with the whole sheet
+    """
+    name: str
+    suffixes: tuple[str, ...]
+    available: Callable[[], bool]
+    read: Callable[[str | os.PathLike, list[str] | None, int | None], pd.DataFrame]
+    streams: bool
+
+
+def _head(rows: Iterator, n_rows: int | None) -> Iterator:
+    """Keeps the header and the first `n_rows` rows, every row when `None`"""
+    return rows if n_rows is None else itertools.islice(rows, n_rows + 1)
+
+
+def _calamine_rows(path: str | os.PathLike) -> Iterator[list]:
+    """Yields the rows of the first sheet with calamine, header first"""
+    from python_calamine import CalamineWorkbook
+
+    workbook = CalamineWorkbook.from_path(str(path))
+    yield from workbook.get_sheet_by_index(0).iter_rows()
+
+
+def read_calamine(path: str | os.PathLike, columns: list[str] | None = None,
+                  n_rows: int | None = None) -> pd.DataFrame:
+    """Reads an Excel export with the Rust-backed calamine parser
+
+    Args:
+        path (str | os.PathLike): path to the Excel export
+        columns (list[str] | None): columns to keep, every column when `None`
+        n_rows (int | None): number of rows to read, every row when `None`
+
+    Returns:
+        pd.DataFrame: projected columns, numbers as float64 and the rest as text
+    """
+    return read_rows_streaming(_head(_calamine_rows(path), n_rows), columns, CHUNK_ROWS, source=str(path))
+
+
+def read_openpyxl(path: str | os.PathLike, columns: list[str] | None = None,
+                  n_rows: int | None = None) -> pd.DataFrame:
+    """Reads an Excel export with openpyxl's read-only mode, one chunk at a time
+
+    Args:
+        path (str | os.PathLike): path to the Excel export
+        columns (list[str] | None): columns to keep, every column when `None`
+        n_rows (int | None): number of rows to read, every row when `None`
+
+    Returns:
+        pd.DataFrame: projected columns, numbers as float64 and the rest as text
+    """
+    return read_rows_streaming(_head(openpyxl_rows(path), n_rows), columns, CHUNK_ROWS, source=str(path))
+
+
+def read_redcap_csv(path: str | os.PathLike, columns: list[str] | None = None,
+                    n_rows: int | None = None) -> pd.DataFrame:
+    """Reads a REDCap CSV export
+
+    Args:
+        path (str | os.PathLike): path to the CSV export
+        columns (list[str] | None): columns to keep, every column when `None`
+        n_rows (int | None): number of rows to read, every row when `None`
+
+    Returns:
+        pd.DataFrame: projected columns, numbers as float64 and the rest as text
+    """
+    data = pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False, na_values=[""],
+                       nrows=n_rows)
+    if columns is not None:
+        data = data[columns]
+    numeric = set(NUMERIC_COLUMNS)
+    for column in data.columns:
+        if column in numeric:
+            data[column] = pd.to_numeric(data[column], errors='coerce').astype(np.float64)
+        else:
+            data[column] = data[column].astype(object).where(data[column].notna(), None)
+    return data
+
+
+# The CSV reader only ever holds the projected columns, which counts as streaming
+READERS = [
+    Reader("calamine", (".xlsx", ".xlsm", ".xls", ".xlsb", ".ods"),
+           lambda: importlib.util.find_spec("python_calamine") is not None, read_calamine, streams=False),
+    Reader("csv", (".csv",), lambda: True, read_redcap_csv, streams=True),
+    Reader("openpyxl", (".xlsx", ".xlsm"), lambda: True, read_openpyxl, streams=True),
+]
+
+# Reader picked for each file suffix and size class, by configuration or benchmark
+_selected: dict[tuple[str, bool], Reader] = {}
+_selected_lock = threading.Lock()
+
+
+def _streaming_only(path: str | os.PathLike) -> bool:
+    """Returns `True` if the export is too large for the non-streaming readers."""
+    return not READER_OVERRIDE and os.path.getsize(path) > STREAMING_THRESHOLD
+
+
+def available_readers(path: str | os.PathLike) -> list[Reader]:
+    """Lists the installed readers that handle a file
+
+    Args:
+        path (str | os.PathLike): path to the export
+
+    Returns:
+        list[Reader]: candidate readers, honoring `ARROW_READER` and, above
+                      `STREAMING_THRESHOLD` bytes, only the streaming ones
+    """
+    suffix = Path(path).suffix.lower()
+    readers = [reader for reader in READERS if suffix in reader.suffixes and reader.available()]
+    if READER_OVERRIDE:
+        readers = [reader for reader in readers if reader.name == READER_OVERRIDE]
+    elif _streaming_only(path):
+        readers = [reader for reader in readers if reader.streams]
+    if not readers:
+        raise ValueError(f"No available reader for {path}"
+                         + (f" named {READER_OVERRIDE!r}" if READER_OVERRIDE else ""))
+    return readers
+
+
+def benchmark_readers(path: str | os.PathLike, columns: list[str] | None = None,
+                      n_rows: int = BENCHMARK_ROWS) -> dict[str, float]:
+    """Times every available reader on the first rows of an export
+
+    The frames read are discarded, only one is alive at a time.
+
+    Args:
+        path (str | os.PathLike): path to the export
+        columns (list[str] | None): columns to read, every column when `None`
+        n_rows (int): number of rows each reader parses
+
+    Returns:
+        dict[str, float]: seconds taken by each reader
+    """
+    timings = {}
+    for reader in available_readers(path):
+        start = time.perf_counter()
+        reader.read(path, columns, n_rows)
+        timings[reader.name] = time.perf_counter() - start
+    return timings
+
+
+def read_export(path: str | os.PathLike, columns: list[str] | None = None) -> pd.DataFrame:
+    """Reads an export with the fastest available reader
+
+    Args:
+        path (str | os.PathLike): path to the export
+        columns (list[str] | None): columns to read, every column when `None`
+
+    Returns:
+        pd.DataFrame: projected columns, numbers as float64 and the rest as text
+    """
+    key = (Path(path).suffix.lower(), _streaming_only(path))
+    with _selected_lock:
+        reader = _selected.get(key)
+        if reader is None:
+            readers = available_readers(path)
+            if len(readers) > 1:
+                timings = benchmark_readers(path, columns)
+                reader = next(r for r in readers if r.name == min(timings, key=timings.get))
+                logger.info("Reader benchmark on the first %d rows of %s: %s, using %s",
+                            BENCHMARK_ROWS, path,
+                            ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()),
+                            reader.name)
+            else:
+                reader = readers[0]
+            _selected[key] = reader
+    return reader.read(path, columns)
@@ -0,0 +1,79 @@
+"""Compact dtypes for the columns the dashboard reads.
+
+`pd.read_excel` gives object columns for text and float64 for every number.
+Applying the declared schema makes the filter columns categorical, the coded
+columns nullable small integers and the scores float32, which shrinks the
+frame and makes `isin` filters compare integer codes instead of strings.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Text columns with a handful of distinct values
+CATEGORY_COLUMNS = ['sex_dashboard', 'graft_dashboard2', 'insurance_dashboard_use']
+
+# Coded columns (yes/no, REDCap choice codes and form status)
+INT8_COLUMNS = ['prior_aclr', 'rts', 'reinjury', 'long_term_outcomes_complete']
+
+# Patient reported outcome scores and limb symmetry indices
+FLOAT32_COLUMNS = [
+    "ikdc", "pedi_ikdc", "marx", "pedi_fabs", "koos_pain", "koos_sx", "koos_adl",
+    "koos_sport", "koos_qol", "acl_rsi", "tsk", "rsi_score", "rsi_emo", "rsi_con",
+    "sh_lsi", "th_lsi", "ch_lsi", "lsi_ext_mvic_90", "lsi_ext_mvic_60", "lsi_flex_mvic_60",
+    "lsi_ext_isok_60", "lsi_flex_isok_60", "lsi_ext_isok_90", "lsi_flex_isok_90",
+    "lsi_ext_isok_180", "lsi_flex_isok_180"]
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    """Returns the memory used by a dataframe in bytes, strings included."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _record_ids(values: pd.Series) -> pd.Series:
+    """Stores record ids as the smallest integer type, or as codes when they are text"""
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notna().all() and (numeric % 1 == 0).all():
+        return pd.to_numeric(numeric.astype(np.int64), downcast='integer')
+    return values.astype('category')
+
+
+def _int8(values: pd.Series) -> pd.Series:
+    """Stores a coded column as nullable int8, keeping it as float32 if it is not"""
+    numeric = pd.to_numeric(values, errors='coerce')
+    try:
+        return numeric.astype('Int8')
+    except (TypeError, ValueError):
+        # Fractional or out of range codes, keep every value
+        return numeric.astype(np.float32)
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the dashboard columns of a dataframe to their compact dtypes
+
+    Columns missing from the dataframe are skipped and the other columns are
+    left as they are. Logs the memory used before and after.
+
+    Args:
+        df (pd.DataFrame): arrow dataframe as parsed from the export
+
+    Returns:
+        pd.DataFrame: dataframe with compact dtypes
+    """
+    before = frame_memory(df)
+    if 'record_id' in df:
+        df['record_id'] = _record_ids(df['record_id'])
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    for column in INT8_COLUMNS:
+        if column in df:
+            df[column] = _int8(df[column])
+    for column in FLOAT32_COLUMNS:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float32)
+    after = frame_memory(df)
+    logger.info("Applied dtype schema: %.1f MB -> %.1f MB", before / 1e6, after / 1e6)
+    return df
@@ -0,0 +1,224 @@
+"""Approximate distinct patient counts from mergeable HyperLogLog sketches.
+
+Pooled registries make exact distinct counts scan every non-blank row under
+the filter. A HyperLogLog sketch instead summarizes a set of record ids in
+`2 ** HLL_PRECISION` small registers, and the sketch of a union is the
+elementwise maximum of the sketches. One sketch is kept per variable and per
+cell of the range cube's grid (categorical cell, age key, tss key), so any
+filter the cube answers is the union of a rectangle of grid cells, and a
+query merges those sketches instead of reading rows. The estimate has a
+relative standard error of about `RELATIVE_ERROR`.
+
+Maxima cannot be taken back, so the sketches are rebuilt with the dataset,
+never patched. They are only built when `APPROXIMATE_DISTINCT` is set, through
+`ARROW_DISTINCT_COUNTS=approximate`, and the dataset has a cube; exact counts
+stay the default.
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from arrow_counter.cube import RangeCube
+from arrow_counter.index import long_term_outcome_mask
+
+# `exact` counts distinct patients from the rows, `approximate` from the sketches
+DISTINCT_COUNTS = os.getenv("ARROW_DISTINCT_COUNTS", "exact")
+APPROXIMATE_DISTINCT = DISTINCT_COUNTS == "approximate"
+
+# Registers per sketch are 2 ** HLL_PRECISION, more registers are more exact
+HLL_PRECISION = int(os.getenv("ARROW_HLL_PRECISION", "10"))
+
+# Relative standard error of an estimate
+RELATIVE_ERROR = 1.04 / np.sqrt(2 ** HLL_PRECISION)
+
+
+# Value of 2 ** -rank for every register value
+_INVERSE_POWERS = np.exp2(-np.arange(256, dtype=np.float64))
+
+
+def _alpha(n_registers: int) -> float:
+    """Bias correction constant of the HyperLogLog estimate"""
+    return {16: 0.673, 32: 0.697, 64: 0.709}.get(n_registers, 0.7213 / (1 + 1.079 / n_registers))
+
+
+def hash_registers(record_ids: pd.Series, precision: int) -> tuple[np.ndarray, np.ndarray]:
+    """Assigns every record id its register and rank
+
+    The low `precision` bits of the id's 64-bit hash pick the register, the
+    rank is one plus the number of leading zeros of the remaining bits.
+
+    Args:
+        record_ids (pd.Series): record id of every row
+        precision (int): number of register bits
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: register and rank of each row
+    """
+    codes, uniques = pd.factorize(record_ids)
+    hashes = pd.util.hash_array(np.asarray(uniques, dtype=object))[codes]
+    registers = (hashes & np.uint64((1 << precision) - 1)).astype(np.int64)
+    rest = hashes >> np.uint64(precision)
+    # Bit length of the remaining bits by binary search, exact unlike log2
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = rest >= np.uint64(1 << shift)
+        bit_length[wide] += shift
+        rest[wide] >>= np.uint64(shift)
+    bit_length += rest.astype(np.int64)
+    ranks = (64 - precision) - bit_length + 1
+    return registers, ranks.astype(np.uint8)
+
+
+def estimate(registers: np.ndarray) -> np.ndarray:
+    """Estimates the number of distinct ids from merged registers
+
+    Args:
+        registers (np.ndarray): registers on the last axis
+
+    Returns:
+        np.ndarray: estimated distinct counts, rounded
+    """
+    n_registers = registers.shape[-1]
+    raw = _alpha(n_registers) * n_registers ** 2 / _INVERSE_POWERS[registers].sum(axis=-1)
+    # Small cardinalities are counted from the empty registers instead
+    empty = np.count_nonzero(registers == 0, axis=-1)
+    small = (raw <= 2.5 * n_registers) & (empty > 0)
+    linear = n_registers * np.log(n_registers / np.maximum(empty, 1))
+    return np.rint(np.where(small, linear, raw)).astype(np.int64)
+
+
+@dataclass(frozen=True)
+class DistinctSketches:
+    """HyperLogLog sketches of record ids on the range cube's grid
+
+    Sketches are stored sparsely: only non-empty registers are kept, grouped
+    by grid cell, as one flat slot (variable and register) and rank each.
+
+    Attributes:
+        cube (RangeCube): cube whose grid and filters the sketches share
+        variables (list[str]): sketched variables
+        precision (int): number of register bits
+        starts (np.ndarray): first entry of each flat grid cell, plus the end
+        slots (np.ndarray): variable * registers + register of each entry
+        ranks (np.ndarray): register value of each entry
+    """
+    cube: RangeCube
+    variables: list[str]
+    precision: int
+    starts: np.ndarray
+    slots: np.ndarray
+    ranks: np.ndarray
+
+    def can_answer(self, cols: dict[str, list | tuple], variables: list[str]) -> bool:
+        """Returns `True` if the sketches cover the filters and variables."""
+        return self.cube.can_answer(cols, variables) and set(variables) <= set(self.variables)
+
+    def _merge(self, cells: np.ndarray, age: tuple[int, int],
+               tss_ranges: list[tuple[int, int]]) -> np.ndarray:
+        """Merges the sketches of every grid rectangle, one per tss range
+
+        Returns:
+            np.ndarray: registers shaped (tss range, variable, register)
+        """
+        n_age, n_tss = len(self.cube.age_keys), len(self.cube.tss_keys)
+        n_slots = len(self.variables) << self.precision
+        # Every (cell, age key) row of the rectangle is a contiguous run of entries
+        rows = (cells[:, None] * n_age + np.arange(*age)).reshape(-1) * n_tss
+        run_starts, run_ends, run_offsets = [], [], []
+        for position, (t0, t1) in enumerate(tss_ranges):
+            if t1 > t0:
+                run_starts.append(self.starts[rows + t0])
+                run_ends.append(self.starts[rows + t1])
+                run_offsets.append(np.full(len(rows), position * n_slots, dtype=np.int64))
+        registers = np.zeros(len(tss_ranges) * n_slots, dtype=np.uint8)
+        if run_starts:
+            run_starts, run_ends = np.concatenate(run_starts), np.concatenate(run_ends)
+            lengths = run_ends - run_starts
+            # Entry positions of all runs, without a Python loop over them
+            entries = np.arange(lengths.sum()) + np.repeat(run_starts - np.cumsum(lengths) + lengths, lengths)
+            slots = self.slots[entries] + np.repeat(np.concatenate(run_offsets), lengths)
+            np.maximum.at(registers, slots, self.ranks[entries])
+        return registers.reshape(len(tss_ranges), len(self.variables), -1)
+
+    def count(self, cols: dict[str, list | tuple], variables: list[str],
+              only_long_term_outcomes: bool = False) -> dict[str, int]:
+        """Estimates distinct patients with a non-blank value for each variable
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column, see `can_answer`
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, int]: dictionary of estimated distinct record id counts
+        """
+        cells = self.cube.cells(cols, only_long_term_outcomes)
+        registers = self._merge(cells, self.cube.key_range(cols, 'age'), [self.cube.key_range(cols, 'tss')])
+        counts = estimate(registers[0])
+        return {var: int(counts[self.variables.index(var)]) for var in variables}
+
+    def count_by_timepoint(self, cols: dict[str, list | tuple], timepoints: dict[str, tuple[int, int]],
+                           variables: list[str],
+                           only_long_term_outcomes: bool = False) -> dict[str, dict[str, int]]:
+        """Estimates distinct patients for each variable and timepoint
+
+        Args:
+            cols (dict[str, list | tuple]): selected filters by column, see `can_answer`
+            timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                     bound included, right excluded
+            variables (list[str]): list of columns to count
+            only_long_term_outcomes (bool): only keep record ids with a long-term outcome
+
+        Returns:
+            dict[str, dict[str, int]]: estimated distinct record id counts by
+                                       variable and timepoint
+        """
+        cells = self.cube.cells(cols, only_long_term_outcomes)
+        tss_ranges = [self.cube.timepoint_range(cols, tp_low, tp_high)
+                      for tp_low, tp_high in timepoints.values()]
+        counts = estimate(self._merge(cells, self.cube.key_range(cols, 'age'), tss_ranges))
+        positions = [self.variables.index(var) for var in variables]
+        return {var: {tp_label: int(counts[tp, position]) for tp, tp_label in enumerate(timepoints)}
+                for var, position in zip(variables, positions)}
+
+
+def build_distinct_sketches(df: pd.DataFrame, cube: RangeCube, variables: list[str],
+                            long_term_outcomes: np.ndarray | None = None,
+                            precision: int = HLL_PRECISION) -> DistinctSketches:
+    """Sketches the record ids of every variable on the cube's grid
+
+    Args:
+        df (pd.DataFrame): arrow dataframe the cube was built from
+        cube (RangeCube): cube over every row of `df`
+        variables (list[str]): variables to sketch
+        long_term_outcomes (np.ndarray | None): precomputed rows of the records
+                                                with a long-term outcome
+        precision (int): number of register bits
+
+    Returns:
+        DistinctSketches: sketches over the rows with a record id
+    """
+    if long_term_outcomes is None:
+        long_term_outcomes = long_term_outcome_mask(df)
+    cell_index, age_index, tss_index = cube.locate(df, long_term_outcomes)
+    n_groups = len(cube.long_term) * len(cube.age_keys) * len(cube.tss_keys)
+    groups = (cell_index * len(cube.age_keys) + age_index) * len(cube.tss_keys) + tss_index
+    registers, ranks = hash_registers(df['record_id'], precision)
+
+    notna = df[variables].notna().to_numpy() & df['record_id'].notna().to_numpy()[:, None]
+    row_position, variable_position = np.nonzero(notna)
+    slots = (variable_position << precision) + registers[row_position]
+    # Keep the highest rank of every (grid cell, slot), ranks fit in 6 bits
+    keys = np.unique(((groups[row_position] * (len(variables) << precision) + slots) << 6)
+                     + ranks[row_position])
+    entry_keys = keys >> 6
+    highest = np.append(entry_keys[1:] != entry_keys[:-1], True)
+    keys, entry_keys = keys[highest], entry_keys[highest]
+
+    entry_groups = entry_keys // (len(variables) << precision)
+    starts = np.searchsorted(entry_groups, np.arange(n_groups + 1))
+    return DistinctSketches(cube=cube, variables=list(variables), precision=precision, starts=starts,
+                            slots=(entry_keys % (len(variables) << precision)).astype(np.int32),
+                            ranks=(keys & 63).astype(np.uint8))
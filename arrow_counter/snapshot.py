@@ -0,0 +1,198 @@
+"""Columnar on-disk snapshots of the processed ARROW dataset.
+
+Parsing the REDCap Excel export through openpyxl takes seconds. The first load
+of a given export writes the processed frame to an Arrow IPC (Feather) file
+named after the export's content hash; every later load, including after a
+process restart or redeploy, memory-maps that file instead.
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Directory the snapshots are written to. Can be pointed somewhere persistent
+# (e.g. a mounted volume) so snapshots survive redeploys.
+SNAPSHOT_DIR = Path(os.getenv("ARROW_SNAPSHOT_DIR", ".snapshots"))
+
+# Bump this whenever the processing applied before a snapshot is written
+# changes, so stale snapshots are never read back.
+SNAPSHOT_VERSION = 4
+
+# Snapshots kept per processing once a new export is swapped in, the newest first
+SNAPSHOT_KEEP = int(os.getenv("ARROW_SNAPSHOT_KEEP", "2"))
+
+
+def file_digest(path: str | os.PathLike, chunk_size: int = 1 << 20) -> str:
+    """Hashes the content of a file
+
+    Args:
+        path (str | os.PathLike): file to hash
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+        str: hex sha256 digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_path(source: str | os.PathLike, digest: str, tag: str = "",
+                  snapshot_dir: Path = SNAPSHOT_DIR) -> Path:
+    """Builds the snapshot file name for a source file
+
+    Args:
+        source (str | os.PathLike): source export
+        digest (str): content hash of the source export
+        tag (str): name of the processing applied to the source, so different
+                   processing of the same export gets its own snapshot
+        snapshot_dir (Path): directory holding the snapshots
+
+    Returns:
+        Path: path of the snapshot for this source content
+    """
+    stem = Path(source).stem + (f".{tag}" if tag else "")
+    return snapshot_dir / f"{stem}-{digest[:16]}-v{SNAPSHOT_VERSION}.arrow"
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """Makes mixed-type object columns storable in Arrow
+
+    REDCap exports contain free-text columns where some cells were parsed as
+    numbers and others as strings (e.g. 'Pro_1' next to 12). Arrow needs one
+    type per column, so the non-blank cells of such columns are stored as text.
+    """
+    df = df.copy(deep=False)
+    for column in df.columns[df.dtypes == object]:
+        values = df[column].dropna()
+        if values.map(type).nunique() > 1:
+            df[column] = df[column].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def write_snapshot(df: pd.DataFrame, path: Path) -> None:
+    """Writes a dataframe to an uncompressed Arrow IPC file
+
+    The file is written next to its final location and renamed into place, so
+    concurrent readers never see a partially written snapshot.
+
+    Args:
+        df (pd.DataFrame): dataframe to store
+        path (Path): destination of the snapshot
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    # Uncompressed so the file can be memory-mapped without decoding
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: Path) -> pd.DataFrame:
+    """Memory-maps a snapshot and returns it as a dataframe
+
+    Args:
+        path (Path): snapshot to read
+
+    Returns:
+        pd.DataFrame: stored dataframe
+    """
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def _remove_stale(keep: Path) -> None:
+    """Deletes older snapshots of the same export name and processing"""
+    stem = keep.name.rsplit("-", 2)[0]
+    for old in keep.parent.glob(f"{stem}-*.arrow"):
+        if old != keep:
+            old.unlink(missing_ok=True)
+
+
+def _snapshot_tag(path: Path) -> str | None:
+    """Returns the processing tag in a snapshot's name, `None` if it has none"""
+    prefix = path.name.rsplit("-", 2)[0]
+    _, dot, tag = prefix.rpartition(".")
+    return tag if dot else None
+
+
+def prune_snapshots(keep: Path, keep_last: int = SNAPSHOT_KEEP) -> list[Path]:
+    """Deletes the snapshots of other exports with the same processing
+
+    Snapshots are named after their export, so every new timestamped export
+    adds one. Only `keep` and the most recently written others, `keep_last`
+    in total, are left. Frames already memory-mapped from a deleted file stay
+    readable until they are released.
+
+    Args:
+        keep (Path): snapshot of the dataset being served
+        keep_last (int): number of snapshots of this processing to keep
+
+    Returns:
+        list[Path]: deleted snapshots
+    """
+    tag = _snapshot_tag(keep)
+    others = [path for path in keep.parent.glob("*.arrow")
+              if path != keep and path.is_file() and _snapshot_tag(path) == tag]
+    others.sort(key=lambda path: path.stat().st_mtime_ns, reverse=True)
+    deleted = []
+    for old in others[max(keep_last - 1, 0):]:
+        try:
+            old.unlink()
+        except OSError:
+            # Still open on a platform that cannot delete open files
+            continue
+        deleted.append(old)
+    return deleted
+
+
+def load_snapshot(source: str | os.PathLike, build: Callable[[str | os.PathLike], pd.DataFrame],
+                  tag: str = "", digest: str | None = None,
+                  snapshot_dir: Path = SNAPSHOT_DIR) -> pd.DataFrame:
+    """Loads the processed dataset from its snapshot, building it if needed
+
+    Args:
+        source (str | os.PathLike): source export
+        build (Callable[[str | os.PathLike], pd.DataFrame]): parses and processes
+            the source export when no snapshot exists for its content yet
+        tag (str): name of the processing done by `build`
+        digest (str | None): content hash of the source if the caller already
+                             computed it
+        snapshot_dir (Path): directory holding the snapshots
+
+    Returns:
+        pd.DataFrame: processed dataset
+    """
+    path = snapshot_path(source, digest or file_digest(source), tag, snapshot_dir)
+    if path.exists():
+        try:
+            return read_snapshot(path)
+        except (OSError, pa.ArrowInvalid):
+            # Corrupt or truncated snapshot, rebuild it from the source
+            path.unlink(missing_ok=True)
+
+    return save_snapshot(build(source), path)
+
+
+def save_snapshot(df: pd.DataFrame, path: Path) -> pd.DataFrame:
+    """Stores a processed dataset and replaces the older snapshots of its export
+
+    Args:
+        df (pd.DataFrame): processed dataset
+        path (Path): destination of the snapshot, from `snapshot_path`
+
+    Returns:
+        pd.DataFrame: memory-mapped snapshot, or `df` when it cannot be written
+    """
+    try:
+        write_snapshot(df, path)
+        _remove_stale(path)
+    except OSError:
+        # Read-only filesystem: still serve the freshly built data
+        return df
+    return read_snapshot(path)
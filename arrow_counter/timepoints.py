@@ -0,0 +1,52 @@
+"""Timepoint counts from counts per tss bin.
+
+Every counting path bins tss once against the edges of all timepoints instead
+of scanning the rows once per timepoint. Bin i holds tss in
+[edges[i], edges[i + 1]), so a timepoint is a run of consecutive bins and its
+count is the difference of two cumulative sums over the bins. Timepoints may
+overlap or leave gaps.
+"""
+import numpy as np
+
+
+def timepoint_edges(timepoints: dict[str, tuple[int, int]]) -> np.ndarray:
+    """Returns the sorted bounds of every timepoint, the edges of the tss bins"""
+    return np.unique([bound for tp_range in timepoints.values() for bound in tp_range])
+
+
+def timepoint_sums(edges: np.ndarray, bin_counts: np.ndarray,
+                   timepoints: dict[str, tuple[int, int]]) -> np.ndarray:
+    """Adds up the bins of every timepoint
+
+    Args:
+        edges (np.ndarray): bin edges, see `timepoint_edges`
+        bin_counts (np.ndarray): counts shaped (..., bin, variable)
+        timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                 bound included, right excluded
+
+    Returns:
+        np.ndarray: counts shaped (..., timepoint, variable)
+    """
+    zeros = np.zeros_like(bin_counts[..., :1, :], dtype=np.int64)
+    cumulative = np.concatenate([zeros, bin_counts.cumsum(axis=-2)], axis=-2)
+    low = np.searchsorted(edges, [tp_low for tp_low, _ in timepoints.values()])
+    high = np.searchsorted(edges, [tp_high for _, tp_high in timepoints.values()])
+    return cumulative[..., high, :] - cumulative[..., low, :]
+
+
+def timepoint_counts(edges: np.ndarray, bin_counts: np.ndarray, timepoints: dict[str, tuple[int, int]],
+                     variables: list[str]) -> dict[str, dict[str, int]]:
+    """Adds up the bins of every timepoint, by variable
+
+    Args:
+        edges (np.ndarray): bin edges, see `timepoint_edges`
+        bin_counts (np.ndarray): counts shaped (bin, variable)
+        timepoints (dict[str, tuple[int, int]]): timepoints in months, left
+                                                 bound included, right excluded
+        variables (list[str]): counted variables, the columns of `bin_counts`
+
+    Returns:
+        dict[str, dict[str, int]]: dictionary of variables and their longitudinal counts
+    """
+    sums = timepoint_sums(edges, bin_counts, timepoints).T.tolist()
+    return {var: dict(zip(timepoints, var_counts)) for var, var_counts in zip(variables, sums)}
@@ -0,0 +1,111 @@
+"""Streamlit widgets shared by the dashboard pages."""
+import hmac
+import os
+
+import streamlit as st
+
+from arrow_counter import engine
+from arrow_counter.data import Dataset
+from arrow_counter.warmup import default_filters, start_warmup
+from arrow_counter.watcher import start_watcher
+
+# Filters with subgroups
+FILTER_COLUMNS = {
+    "Participant Sex": ["Female", "Male"],
+    "Graft Type": ["Allograft", "BTB autograft", "HS autograft", "Other", "QT autograft"],
+    "Prior ACL?": ["Yes", "No"]
+}
+
+
+def check_password():
+    """Returns `True` if the user had the correct password."""
+
+    def password_entered():
+        """Checks whether a password entered by the user is correct."""
+        secret_password = os.getenv("PASSWORD")
+        if hmac.compare_digest(st.session_state["password"], secret_password):
+            st.session_state["password_correct"] = True
+            del st.session_state["password"]  # deletes password
+        else:
+            st.session_state["password_correct"] = False
+
+    if st.session_state.get("password_correct", False):
+        return True
+
+    # Load the data and warm the default queries while the user logs in
+    start_warmup()
+
+    # Ask user for password
+    st.text_input(
+        "Password", type="password", on_change=password_entered, key="password"
+    )
+    if "password_correct" in st.session_state:
+        st.error("😕 Password incorrect")
+    return False
+
+
+def load_dataset() -> Dataset:
+    """Returns the process-wide dataset, showing a spinner while it loads
+
+    Also starts watching the data directory for newer exports.
+
+    Returns:
+        Dataset: loaded arrow dataset
+    """
+    if not engine.dataset_loaded():
+        with st.spinner("Loading data..."):
+            engine.get_dataset()
+    start_watcher()
+    return engine.get_dataset()
+
+
+def filter_widgets(data) -> dict[str, list | tuple]:
+    """Renders the filter criteria widgets
+
+    Args:
+        data (pd.DataFrame): arrow dataframe, used for the slider bounds
+
+    Returns:
+        dict[str, list | tuple]: selected filters by column
+    """
+    # Ask for filter criteria
+    st.subheader("Enter criteria:")
+    cols = {}
+
+    # Make drop-down selections for each filter
+    for column, options in FILTER_COLUMNS.items():
+        if column == "Prior ACL?":
+            selected_values = st.multiselect(
+                f"Select value/s for '{column}' (**Leave blank to select all**)", options)
+            # Converting yes/no to 1/0
+            selected_values = [1 if v == "Yes" else 0 for v in selected_values]
+            if selected_values:  # Only add to cols if not empty
+                cols['prior_aclr'] = selected_values  # Correct column name
+        elif column == "Participant Sex":
+            selected_values = st.multiselect(
+                f"Select value/s for '{column}' (**Leave blank to select all**)", options)
+            if selected_values:  # Only add to cols if not empty
+                cols['sex_dashboard'] = selected_values  # Correct column name
+        elif column == "Graft Type":
+            selected_values = st.multiselect(
+                f"Select value/s for '{column}' (**Leave blank to select all**)", options)
+            if selected_values:  # Only add to cols if not empty
+                cols['graft_dashboard2'] = selected_values  # Correct column name
+
+    # Slider bounds, the same full ranges the warm-up queries use
+    ranges = default_filters(data)
+
+    # Add age range slider
+    age_min, age_max = ranges['age']
+    age_range = st.slider("Select age range (**Leave blank to select all**)", min_value=age_min,
+                          # Slider widget with integer step
+                          max_value=age_max, value=(age_min, age_max), step=1)
+    cols['age'] = age_range
+
+    # Add tss range slider
+    tss_min, tss_max = ranges['tss']
+    tss_range = st.slider("Select time since surgery range (in months) (**Leave blank to select all**)",
+                          min_value=tss_min, max_value=tss_max, value=(tss_min, tss_max), step=1)
+    cols['tss'] = tss_range
+
+    return cols
@@ -0,0 +1,77 @@
+"""Background warm-up of the dataset and the default queries.
+
+The first session after a deploy would otherwise pay for parsing the export,
+building the indexes and running the first query. `start_warmup` does all of
+it on a daemon thread as soon as the server runs the home page, so by the time
+a clinician is past the login screen the default results are in the cache.
+"""
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from arrow_counter import engine
+from arrow_counter.data import TIMEPOINTS, VARIABLES, Dataset
+
+logger = logging.getLogger(__name__)
+
+
+def default_filters(data: pd.DataFrame) -> dict[str, tuple[int, int]]:
+    """Returns the filters the pages start with, the full age and tss ranges
+
+    Args:
+        data (pd.DataFrame): arrow dataframe
+
+    Returns:
+        dict[str, tuple[int, int]]: (low, high) slider range by column
+    """
+    # Add 1 to the max because int takes the floor of the float
+    return {column: (int(data[column].min()), int(data[column].max() + 1))
+            for column in ('age', 'tss')}
+
+
+def warm_queries(dataset: Dataset) -> None:
+    """Runs the default query of both pages so their results are cached
+
+    Args:
+        dataset (Dataset): dataset to run the queries on
+    """
+    cols = default_filters(dataset.frame)
+    engine.count_non_blank(dataset, cols=cols, variables=VARIABLES)
+    for only_long_term_outcomes in (False, True):
+        engine.count_by_timepoint(dataset, cols=cols, timepoints=TIMEPOINTS, variables=VARIABLES,
+                                  only_long_term_outcomes=only_long_term_outcomes)
+
+
+def warm_up() -> None:
+    """Loads the process-wide dataset and warms the default queries."""
+    start = time.perf_counter()
+    warm_queries(engine.get_dataset())
+    logger.info("Warm-up done in %.2f s", time.perf_counter() - start)
+
+
+_warmup: threading.Thread | None = None
+_warmup_lock = threading.Lock()
+
+
+def _run() -> None:
+    try:
+        warm_up()
+    except Exception:
+        # Sessions load the dataset themselves if the warm-up failed
+        logger.exception("Warm-up failed")
+
+
+def start_warmup() -> threading.Thread:
+    """Starts the warm-up thread once per process
+
+    Returns:
+        threading.Thread: warm-up thread, possibly already finished
+    """
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = threading.Thread(target=_run, name="arrow-warmup", daemon=True)
+            _warmup.start()
+    return _warmup
@@ -0,0 +1,113 @@
+"""Background pickup of new REDCap exports.
+
+A daemon thread polls the data directory. When a newer export appears, or the
+current one is overwritten, it builds the complete dataset (snapshot, index
+and cube) off the request path and swaps it into the engine in one step, so
+sessions never wait on the rebuild or see a half-built dataset. Once a dataset
+is loaded, new exports are diffed against it and only the changed records are
+reprocessed.
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+
+from arrow_counter import engine
+from arrow_counter.data import COLUMNS, DATA_DIR, latest_export, load_dataset, snapshot_tag
+from arrow_counter.delta import load_delta
+from arrow_counter.snapshot import prune_snapshots, snapshot_path
+from arrow_counter.warmup import warm_queries
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two polls of the data directory
+WATCH_INTERVAL = float(os.getenv("ARROW_WATCH_INTERVAL", "30"))
+
+
+def _signature(path: Path) -> tuple[str, int, int]:
+    """Cheap change marker of an export, avoids hashing it on every poll"""
+    stat = path.stat()
+    return str(path), stat.st_size, stat.st_mtime_ns
+
+
+class ExportWatcher(threading.Thread):
+    """Polls a directory and swaps in the dataset of each new export
+
+    Args:
+        data_dir (Path): directory holding the exports
+        interval (float): seconds between two polls
+    """
+
+    def __init__(self, data_dir: Path = DATA_DIR, interval: float = WATCH_INTERVAL):
+        super().__init__(name="arrow-export-watcher", daemon=True)
+        self.data_dir = Path(data_dir)
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._loaded = None
+        self._pending = None
+        if engine.dataset_loaded():
+            self._loaded = _signature(Path(engine.get_dataset().source))
+
+    def check(self) -> bool:
+        """Polls once, building and swapping in a new dataset if needed
+
+        An export is only loaded once it is unchanged between two polls, so a
+        file still being copied into the directory is never read.
+
+        Returns:
+            bool: `True` if a new dataset was swapped in
+        """
+        signature = _signature(latest_export(self.data_dir))
+        if signature == self._loaded:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            self._pending = signature
+            return False
+
+        current = engine.get_dataset() if engine.dataset_loaded() else None
+        if current is None:
+            dataset = load_dataset(signature[0])
+        else:
+            dataset = load_delta(current, signature[0])
+        self._loaded, self._pending = signature, None
+        if current is not None and current.version == dataset.version:
+            return False
+        engine.swap_dataset(dataset)
+        logger.info("Swapped in dataset %s from %s", dataset.version[:12], dataset.source)
+        # Each timestamped export has its own snapshot, drop the older ones
+        for old in prune_snapshots(snapshot_path(dataset.source, dataset.version, snapshot_tag(COLUMNS))):
+            logger.info("Removed snapshot %s", old.name)
+        # The swap dropped the cached results of the previous export
+        warm_queries(dataset)
+        return True
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # Keep serving the current dataset and retry on the next poll
+                logger.exception("Loading a new export from %s failed", self.data_dir)
+
+    def stop(self) -> None:
+        """Stops polling after the current check."""
+        self._stop_event.set()
+
+
+_watcher: ExportWatcher | None = None
+_watcher_lock = threading.Lock()
+
+
+def start_watcher() -> ExportWatcher:
+    """Starts the process-wide export watcher if it is not running yet
+
+    Returns:
+        ExportWatcher: running watcher
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = ExportWatcher()
+            _watcher.start()
+    return _watcher
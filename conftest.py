@@ -0,0 +1 @@
+"""Makes the `arrow_counter` package importable when pytest runs from the repository root."""
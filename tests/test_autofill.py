@@ -0,0 +1,20 @@
+"""Autofill never fills a record from the rows of another record."""
+import pandas as pd
+import pytest
+
+from arrow_counter.data import autofill
+
+
+@pytest.mark.parametrize("record_ids", [[1, 1, 2, 2], [2, 2, 1, 1]], ids=["sorted", "unsorted"])
+def test_record_without_values_stays_blank(record_ids):
+    # Only the second record has a value, on its second row
+    df = pd.DataFrame({'record_id': record_ids,
+                       'sex_dashboard': pd.Categorical([None, None, None, 'Female']),
+                       'prior_aclr': pd.array([None, None, None, 1], dtype='Int8')})
+
+    filled = autofill(df, ['sex_dashboard', 'prior_aclr'])
+
+    assert filled['sex_dashboard'].isna().tolist() == [True, True, False, False]
+    assert filled['sex_dashboard'].tolist()[2:] == ['Female', 'Female']
+    assert filled['prior_aclr'].isna().tolist() == [True, True, False, False]
+    assert filled['prior_aclr'].tolist()[2:] == [1, 1]
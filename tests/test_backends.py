@@ -0,0 +1,105 @@
+"""Parity of the DuckDB and Polars backends with the pandas counts."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from arrow_counter.data import COLUMNS, TIMEPOINTS, VARIABLES, Dataset, build_dataset, parse_and_autofill
+from arrow_counter.engine import count_masked, filter_mask, longitudinal_filter, row_backend
+
+# Filters the cube cannot answer are the interesting ones: fractional bounds,
+# empty value lists and every categorical column at once
+SPECS = [
+    {},
+    {'age': (0, 100), 'tss': (0, 200)},
+    {'age': (14.5, 20.25)},
+    {'tss': (3.5, 12)},
+    {'age': (15, 15.5), 'tss': (5, 5)},
+    {'sex_dashboard': ['Female']},
+    {'sex_dashboard': [], 'prior_aclr': [1]},
+    {'graft_dashboard2': ['HS autograft', 'Other'], 'age': (12.2, 30)},
+    {'sex_dashboard': ['Male'], 'graft_dashboard2': ['Other'], 'prior_aclr': [0], 'tss': (4, 24.5)},
+]
+
+
+def check_parity(dataset: Dataset, specs: list[dict[str, list | tuple]], backend: str,
+                 variables: list[str] = VARIABLES,
+                 timepoints: dict[str, tuple[int, int]] = TIMEPOINTS) -> list[str]:
+    """Compares the counts of a backend with the pandas ones
+
+    Every spec is counted with and without the long-term outcome filter, in
+    total and by timepoint.
+
+    Args:
+        dataset (Dataset): loaded arrow dataset
+        specs (list[dict[str, list | tuple]]): filters by column, one dict per query
+        backend (str): backend to check, one of `engine.BACKENDS`
+        variables (list[str]): list of columns to count
+        timepoints (dict[str, tuple[int, int]]): timepoints for longitudinal filter in months
+
+    Returns:
+        list[str]: description of every count that differs, empty on parity
+    """
+    checked = row_backend(dataset, backend)
+    mismatches = []
+    for cols in specs:
+        for only_long_term_outcomes in (False, True):
+            mask = filter_mask(dataset.frame, cols, only_long_term_outcomes, dataset.index)
+            expected = {var: {"total": count}
+                        for var, count in count_masked(dataset.frame, mask, variables).items()}
+            for var, counts in longitudinal_filter(dataset.frame, timepoints, variables, mask).items():
+                expected[var].update(counts)
+
+            actual = {var: {"total": count}
+                      for var, count in checked.count(cols, variables, only_long_term_outcomes).items()}
+            for var, counts in checked.count_by_timepoint(cols, timepoints, variables,
+                                                          only_long_term_outcomes).items():
+                actual[var].update(counts)
+
+            mismatches.extend(
+                f"{cols} long-term={only_long_term_outcomes} {var} {label}: "
+                f"pandas {expected[var][label]}, {backend} {actual[var][label]}"
+                for var in variables for label in expected[var]
+                if expected[var][label] != actual[var][label])
+    return mismatches
+
+
+def synthetic_export(n_records: int = 60, seed: int = 0) -> pd.DataFrame:
+    """Builds a REDCap-like export: one demographics row per record, then visits
+
+    Some visits have no record id, some have a blank age or tss, ages and tss
+    fall on and between whole months, and some records have a long-term outcome.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for record_id in range(1, n_records + 1):
+        rows.append({'record_id': record_id,
+                     'sex_dashboard': rng.choice(['Female', 'Male', None]),
+                     'graft_dashboard2': rng.choice(['HS autograft', 'BTB autograft', 'Other', None]),
+                     'prior_aclr': rng.choice([0, 1, None]),
+                     'insurance_dashboard_use': rng.choice(['Private', 'Not Reported', None])})
+        age = rng.uniform(12, 30)
+        for _ in range(rng.integers(1, 6)):
+            visit = {'record_id': record_id if rng.random() > 0.05 else None,
+                     'age': round(age, int(rng.integers(0, 2))) if rng.random() > 0.1 else None,
+                     'tss': round(rng.uniform(0, 30), int(rng.integers(0, 2))) if rng.random() > 0.1 else None}
+            for var in VARIABLES[1:]:
+                if rng.random() < 0.6:
+                    visit[var] = round(rng.uniform(0, 100), 1)
+            rows.append(visit)
+            age += rng.uniform(0, 1)
+        if rng.random() < 0.3:
+            rows.append({'record_id': record_id, 'long_term_outcomes_complete': 2})
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory) -> Dataset:
+    path = tmp_path_factory.mktemp("export") / "Synthetic_DATA_2024-01-01_0000.csv"
+    synthetic_export().to_csv(path, index=False)
+    return build_dataset(parse_and_autofill(path), version="synthetic", source=str(path))
+
+
+@pytest.mark.parametrize("backend", ["duckdb", "polars"])
+def test_backend_matches_pandas(dataset, backend):
+    pytest.importorskip(backend)
+    assert check_parity(dataset, SPECS, backend) == []